@@ -0,0 +1,125 @@
+#%%
+# Headless batch export: render many filtered PowerPoint reports in one run
+#
+# Examples:
+#   python batch_reports.py --all-buckets
+#   python batch_reports.py all 25-29 "30-34,35-39" --output-dir weekly --workers 4
+#   python batch_reports.py all --segmented
+#   python batch_reports.py --all-buckets --backend duckdb --data sales_history.parquet
+import os
+import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+
+# Template bytes, read once in the parent and handed to each worker once
+worker_template_data = None
+
+# Function run once in every worker process
+def init_worker(template_data):
+    global worker_template_data
+    worker_template_data = template_data
+
+# Function to build one report inside a worker
+def build_report(cube_filtered, output_path, segmented=False):
+    ppt_filename = main.create_presentation(cube_filtered,
+                                            template_data=worker_template_data,
+                                            output_path=output_path,
+                                            segmented=segmented)
+    if not ppt_filename:
+        raise ValueError("Error generating report " + output_path)
+    return ppt_filename
+
+# Function to turn a filter spec ("all" or "25-29,30-34") into dropdown-style categories
+def parse_filter_spec(spec):
+    categories = [category.strip() for category in spec.split(',') if category.strip()]
+    if not categories or 'all' in categories:
+        return ['all']
+    return categories
+
+# Function to name the report file for a filter spec
+def get_report_name(categories, segmented=False):
+    return "sales_report_" + "_".join(categories) + ("_segments" if segmented else "") + ".pptx"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render one PowerPoint report per filter spec.")
+    parser.add_argument('specs', nargs='*',
+                        help='Filter specs: "all" or comma separated age categories, e.g. "25-29,30-34"')
+    parser.add_argument('--all-buckets', action='store_true',
+                        help='Add one report per age bucket from get_age_categories')
+    parser.add_argument('--data', default=main.DATA_PATH, help='Sales CSV file')
+    parser.add_argument('--template', default=main.TEMPLATE_PATH, help='PowerPoint template')
+    parser.add_argument('--stream', action='store_true',
+                        help='Fold the CSV into the aggregates chunk by chunk (files larger than memory)')
+    parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas',
+                        help='Engine the aggregates are built with (duckdb queries the file without loading it)')
+    parser.add_argument('--segmented', action='store_true',
+                        help='Add a slide per 5-year age group to every report')
+    parser.add_argument('--output-dir', default='reports', help='Directory the decks are written to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    start_time = time.time()
+    # Only warnings and errors from the report code, the progress lines come from here
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+
+    # Parse the CSV and build the aggregate cube once for every report
+    main.app_config.update({'data_path': args.data, 'template_path': args.template, 'query_backend': args.backend})
+    if args.stream:
+        main.app_config['ingest_mode'] = 'stream'
+    age_cube = main.get_age_cube()
+
+    specs = [parse_filter_spec(spec) for spec in args.specs]
+    if args.all_buckets:
+        specs += [[option['value']] for option in main.get_age_categories(age_cube)]
+    if not specs:
+        print("Nothing to do: give filter specs or --all-buckets")
+        return 2
+
+    # Read the template once, workers get the bytes when they start
+    if not os.path.exists(args.template):
+        print("Template file not found at " + args.template)
+        return 1
+    with open(args.template, 'rb') as f:
+        template_data = f.read()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Filtering the cube is cheap, only selections with data become jobs
+    jobs = []
+    for categories in specs:
+        cube_filtered = main.filter_cube_by_age(age_cube, categories)
+        if cube_filtered['count'].sum() == 0:
+            print("Skipping", ",".join(categories), "- no rows in this selection")
+            continue
+        jobs.append((cube_filtered, os.path.join(args.output_dir, get_report_name(categories, args.segmented))))
+    if not jobs:
+        print("No selection has any data, no reports written")
+        return 1
+
+    failed = 0
+    workers = max(1, min(args.workers, len(jobs)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(template_data,)) as pool:
+        futures = {}
+        for cube_filtered, output_path in jobs:
+            futures[pool.submit(build_report, cube_filtered, output_path, args.segmented)] = output_path
+
+        for future in as_completed(futures):
+            try:
+                print("Report written:", future.result())
+            except Exception as e:
+                failed += 1
+                print("Report failed:", futures[future], "-", e)
+
+    print(str(len(jobs) - failed) + " of " + str(len(jobs)) + " reports written in "
+          + str(round(time.time() - start_time, 1)) + "s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,319 @@
+#%%
+# Benchmarks for the filter, KPI, chart and PowerPoint export paths
+#
+# Generates synthetic sales data with the online_sales.csv columns, times every
+# stage on its own and the whole report path end to end, and writes the results
+# as JSON so two runs can be compared.
+#
+# Examples:
+#   python benchmark.py --sizes 10k 1m
+#   python benchmark.py --sizes 10m --output bench_10m.json --compare bench_baseline.json
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import importlib.util
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import main
+
+# Row counts that can be given by name
+SIZE_PRESETS = {'10k': 10000, '1m': 1000000, '10m': 10000000, '100m': 100000000}
+
+# Rows written per chunk, so generating 100M rows does not need 100M rows in memory
+GENERATE_CHUNK_ROWS = 1000000
+
+# Selections every filter stage is timed with: everything, one bucket,
+# two touching buckets (merged into one range) and two separate ones
+BENCHMARK_SELECTIONS = [
+    ['all'],
+    ['25-29'],
+    ['25-29', '30-34'],
+    ['20-24', '45-49']
+]
+
+# Selections that also filter by user type and pages, answered with the bitmap indexes
+BENCHMARK_FILTERS = [
+    {'age': ['25-29'], 'user_type': ['new']},
+    {'age': ['20-24', '45-49'], 'pages': ['3-5', '6-9']},
+    {'user_type': ['returning'], 'pages': ['15+'], 'match': 'or'}
+]
+
+# Function to turn "10k", "1m" or a plain number into a row count
+def parse_size(text):
+    text = text.strip().lower()
+    if text in SIZE_PRESETS:
+        return SIZE_PRESETS[text]
+    return int(text)
+
+# Function to write a synthetic sales CSV with the same columns as online_sales.csv
+def write_synthetic_sales(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    written = 0
+    with open(path, 'w', newline='') as f:
+        while written < rows:
+            chunk_rows = min(GENERATE_CHUNK_ROWS, rows - written)
+            # Roughly the shape of the real data: most users in their 20s and 30s,
+            # two thirds new users, a few pages per visit and ~3% converting
+            ages = np.clip(rng.normal(30.5, 8.3, chunk_rows), 17, 80).astype(np.uint8)
+            pages = np.clip(rng.poisson(4.9, chunk_rows), 1, 29).astype(np.uint16)
+            chunk = pd.DataFrame({
+                'age': ages,
+                'new_user': (rng.random(chunk_rows) < 0.685).astype(np.uint8),
+                'total_pages_visited': pages,
+                'converted': (rng.random(chunk_rows) < 0.032).astype(np.uint8)
+            })
+            chunk.to_csv(f, header=(written == 0), index=False)
+            written += chunk_rows
+
+# Function to write a small template with the placeholders create_presentation fills
+def write_minimal_template(path):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    prs.slide_width = Inches(13.333)
+    prs.slide_height = Inches(7.5)
+
+    # Title slide: title + subtitle placeholders
+    title_slide = prs.slides.add_slide(prs.slide_layouts[0])
+    title_slide.shapes.title.text = "Sales Dashboard Report"
+    title_slide.placeholders[1].text = "Generated on"
+
+    # KPI slide: text boxes A, B, C for the KPIs and D, E where the charts go
+    kpi_slide = prs.slides.add_slide(prs.slide_layouts[6])
+    for index, letter in enumerate(['A', 'B', 'C']):
+        text_box = kpi_slide.shapes.add_textbox(Inches(0.5 + 4.2 * index), Inches(1.0), Inches(4), Inches(1))
+        text_box.text_frame.text = letter
+    for index, letter in enumerate(['D', 'E']):
+        text_box = kpi_slide.shapes.add_textbox(Inches(0.5 + 6.5 * index), Inches(3.0), Inches(6), Inches(4))
+        text_box.text_frame.text = letter
+
+    prs.save(path)
+
+# Function to get the peak resident memory of this process in bytes (None if unknown)
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Function to time a stage and record how much memory it allocated at peak
+def measure(stages, stage_name, stage_function, repeat=1, trace_memory=True):
+    timings = []
+    peak_bytes = 0
+    result = None
+    for _ in range(repeat):
+        if trace_memory:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+        result = stage_function()
+        timings.append(time.perf_counter() - start_time)
+        if trace_memory:
+            peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    stages[stage_name] = {
+        'seconds': min(timings),
+        'mean_seconds': sum(timings) / len(timings),
+        'repeat': repeat,
+        'peak_bytes': peak_bytes if trace_memory else None
+    }
+    print("  {:<22} {:>10.4f}s  peak {:>10}".format(
+        stage_name, min(timings), format_bytes(peak_bytes) if trace_memory else "-"))
+    return result
+
+# Function to measure the bytes a dashboard callback sends back per selection:
+# complete figures (how every update used to go out) against the patches sent now
+def measure_payload(cube):
+    from plotly.io.json import to_json_plotly
+    
+    full_bytes = []
+    patch_bytes = []
+    for selected in BENCHMARK_SELECTIONS:
+        total_new_users, total_converted, conversion_rate, sites_bars, conversion_bars = main.compute_dashboard(cube, selected)
+        kpis = [total_new_users, total_converted, conversion_rate]
+        figures = main.build_dashboard_figures(main.get_age_group_stats(main.filter_cube_by_age(cube, selected)))
+        patches = [main.build_figure_patch(sites_bars, main.DASHBOARD_CHART_TITLES['sites']),
+                   main.build_figure_patch(conversion_bars, main.DASHBOARD_CHART_TITLES['conversion'])]
+        full_bytes.append(len(to_json_plotly(kpis + list(figures))))
+        patch_bytes.append(len(to_json_plotly(kpis + patches)))
+    
+    payload = {
+        'full_figures': sum(full_bytes) // len(full_bytes),
+        'patches': sum(patch_bytes) // len(patch_bytes)
+    }
+    print("  {:<22} {:>10} full figures, {} as patches".format(
+        'dashboard_payload', format_bytes(payload['full_figures']), format_bytes(payload['patches'])))
+    return payload
+
+# Function to print a byte count in a readable unit
+def format_bytes(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return str(round(size, 1)) + unit
+        size /= 1024.0
+
+# Function to benchmark every stage for one dataset size
+def run_benchmark(rows, args):
+    data_path = os.path.join(args.work_dir, "synthetic_sales_" + str(rows) + "_" + str(args.seed) + ".csv")
+    columnar_path = data_path[:-4] + ".feather"
+    template_path = os.path.join(args.work_dir, "benchmark_template.pptx")
+    ingest_mode = 'stream' if rows > args.stream_above else 'memory'
+    stages = {}
+    trace_memory = not args.no_memory
+
+    print(str(rows) + " rows (" + ingest_mode + " ingest)")
+    if not os.path.exists(data_path):
+        measure(stages, 'generate', lambda: write_synthetic_sales(data_path, rows, args.seed), trace_memory=False)
+    write_minimal_template(template_path)
+
+    main.app_config.update({'data_path': data_path, 'columnar_path': columnar_path,
+                            'template_path': template_path, 'ingest_mode': ingest_mode})
+
+    # Ingest: parse the CSV (or stream it) into rows and the aggregate cube
+    if ingest_mode == 'stream':
+        df1 = None
+        cube = measure(stages, 'ingest', lambda: main.build_age_cube_streaming(data_path, main.app_config['chunk_size']),
+                       trace_memory=trace_memory)
+    else:
+        if os.path.exists(columnar_path):
+            os.remove(columnar_path)
+        df1 = measure(stages, 'ingest', lambda: main.load_sales_data(data_path, columnar_path), trace_memory=trace_memory)
+        measure(stages, 'ingest_columnar', lambda: main.load_sales_data(data_path, columnar_path), trace_memory=trace_memory)
+        cube = measure(stages, 'build_cube', lambda: main.build_age_cube(df1), trace_memory=trace_memory)
+
+    # The same cube built by DuckDB straight from the CSV, when duckdb is installed
+    if importlib.util.find_spec('duckdb') is not None:
+        measure(stages, 'build_cube_duckdb', lambda: main.query_age_cube_duckdb(data_path), trace_memory=trace_memory)
+        measure(stages, 'filter_duckdb',
+                lambda: [main.query_age_cube_duckdb(data_path, selected) for selected in BENCHMARK_SELECTIONS],
+                trace_memory=trace_memory)
+
+    # Filtering, KPIs and the dashboard callback body, for every benchmark selection
+    measure(stages, 'filter_cube',
+            lambda: [main.filter_cube_by_age(cube, selected) for selected in BENCHMARK_SELECTIONS],
+            repeat=args.repeat, trace_memory=trace_memory)
+    if df1 is not None:
+        age_index = main.build_age_index(df1)
+        measure(stages, 'filter_rows',
+                lambda: [main.filter_dataframe_by_age(df1, selected, age_index) for selected in BENCHMARK_SELECTIONS],
+                repeat=args.repeat, trace_memory=trace_memory)
+        bitmaps = measure(stages, 'build_bitmaps', lambda: main.build_bitmap_index(df1), trace_memory=trace_memory)
+        measure(stages, 'filter_bitmaps',
+                lambda: [main.build_age_cube(df1.iloc[main.select_filtered_rows(bitmaps, age_index, filters)])
+                         for filters in BENCHMARK_FILTERS],
+                repeat=args.repeat, trace_memory=trace_memory)
+    filtered_cubes = [main.filter_cube_by_age(cube, selected) for selected in BENCHMARK_SELECTIONS]
+    measure(stages, 'kpi', lambda: [main.calculate_kpis(cube_filtered) for cube_filtered in filtered_cubes],
+            repeat=args.repeat, trace_memory=trace_memory)
+    measure(stages, 'dashboard',
+            lambda: [main.compute_dashboard(cube, selected) for selected in BENCHMARK_SELECTIONS],
+            repeat=args.repeat, trace_memory=trace_memory)
+
+    payload = measure_payload(cube)
+    
+    # Chart images (matplotlib) and the full PowerPoint export
+    measure(stages, 'chart_total_sites', lambda: main.generate_total_sites_chart(cube),
+            repeat=args.repeat, trace_memory=trace_memory)
+    measure(stages, 'chart_conversion', lambda: main.generate_conversion_chart(cube),
+            repeat=args.repeat, trace_memory=trace_memory)
+    report_path = os.path.join(args.work_dir, "benchmark_report.pptx")
+    measure(stages, 'create_presentation', lambda: main.create_presentation(cube, template_path, output_path=report_path),
+            repeat=args.repeat, trace_memory=trace_memory)
+
+    # End to end: CSV to a saved deck for one selection, as a batch run would do it
+    def end_to_end():
+        if ingest_mode == 'stream':
+            full_cube = main.build_age_cube_streaming(data_path, main.app_config['chunk_size'])
+        else:
+            full_cube = main.build_age_cube(main.load_sales_data(data_path, columnar_path))
+        cube_filtered = main.filter_cube_by_age(full_cube, ['25-29', '30-34'])
+        main.calculate_kpis(cube_filtered)
+        return main.create_presentation(cube_filtered, template_path, output_path=report_path)
+    measure(stages, 'end_to_end', end_to_end, trace_memory=trace_memory)
+
+    return {
+        'rows': rows,
+        'ingest_mode': ingest_mode,
+        'stages': stages,
+        'dashboard_payload_bytes': payload,
+        'peak_rss_bytes': get_peak_rss()
+    }
+
+# Function to compare a run against an earlier results file
+# Returns the number of stages that got slower than the threshold allows
+def compare_results(results, baseline, threshold):
+    baseline_runs = {(run['rows'], run['ingest_mode']): run for run in baseline['runs']}
+    regressions = 0
+    print("Comparison with baseline from " + baseline.get('created', '?'))
+    for run in results['runs']:
+        baseline_run = baseline_runs.get((run['rows'], run['ingest_mode']))
+        if baseline_run is None:
+            print("  " + str(run['rows']) + " rows: not in baseline")
+            continue
+        for stage_name, stage in run['stages'].items():
+            baseline_stage = baseline_run['stages'].get(stage_name)
+            if baseline_stage is None or stage_name == 'generate' or baseline_stage['seconds'] <= 0:
+                continue
+            ratio = stage['seconds'] / baseline_stage['seconds']
+            slower = ratio > 1 + threshold
+            regressions += slower
+            print("  {:>10} rows  {:<22} {:>10.4f}s vs {:>10.4f}s  x{:.2f}{}".format(
+                run['rows'], stage_name, stage['seconds'], baseline_stage['seconds'], ratio,
+                "  REGRESSION" if slower else ""))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard and report export paths on synthetic data.")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '1m'],
+                        help='Dataset sizes: 10k, 1m, 10m, 100m or a row count')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, the fastest one is reported')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic data')
+    parser.add_argument('--work-dir', default='benchmark_data', help='Where generated data and decks are kept')
+    parser.add_argument('--stream-above', type=int, default=SIZE_PRESETS['10m'],
+                        help='Use streaming ingest for datasets with more rows than this')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc (less overhead)')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed slowdown before a stage counts as a regression (0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'chart_backend': main.CHART_BACKEND,
+        'runs': []
+    }
+    for size in args.sizes:
+        results['runs'].append(run_benchmark(parse_size(size), args))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results written to " + args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
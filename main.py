@@ -1,32 +1,195 @@
 
 #%%
-import subprocess
-import matplotlib.ticker as ticker
 import io
 import os
-import matplotlib.pyplot as plt
+import copy
+import atexit
+import select
+import shutil
+import tempfile
+import functools
+import json
+import logging
+import contextlib
+import hashlib
+import sqlite3
+import time
+import uuid
+import threading
+import collections
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pandas as pd 
 from datetime import datetime
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.dml.color import RGBColor
-from pptx.enum.text import PP_ALIGN
-from pptx.enum.shapes import MSO_SHAPE
 import dash
-from pptx.util import Inches
+import flask
 from dash import dcc, html, no_update
 from dash.dependencies import Input, Output, State
 
-app = dash.Dash(__name__)
-df1 = pd.read_csv('online_sales.csv', delimiter = ',')
+# Progress and errors go through a leveled logger, step by step messages are
+# debug so they cost nothing unless somebody turns them on
+logger = logging.getLogger(__name__)
+
+# Latency histograms (seconds), served in Prometheus text format on /metrics
+METRIC_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+METRIC_HELP = {
+    'kpi_report_stage_seconds': "Time spent in each stage of the dashboard and report paths",
+    'kpi_report_callback_seconds': "Latency of the dashboard callbacks"
+}
+metric_histograms = {}
+metrics_lock = threading.Lock()
+
+# Spans recorded by this thread while an export job runs, so a worker process
+# can hand its timings back with the report (None when nobody is collecting)
+span_recorder = threading.local()
+
+# Function to add one observation to a latency histogram
+def observe_latency(metric_name, labels, seconds):
+    key = (metric_name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        histogram = metric_histograms.get(key)
+        if histogram is None:
+            histogram = {'buckets': [0] * len(METRIC_BUCKETS), 'sum': 0.0, 'count': 0}
+            metric_histograms[key] = histogram
+        for index, bound in enumerate(METRIC_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][index] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+# Function to record how long a stage took
+def record_span(stage, seconds, labels=None):
+    labels = dict(labels or {}, stage=stage)
+    observe_latency('kpi_report_stage_seconds', labels, seconds)
+    spans = getattr(span_recorder, 'spans', None)
+    if spans is not None:
+        spans.append((labels, seconds))
+    logger.debug("%s took %.1f ms", stage, seconds * 1000)
+
+# Timed span around one stage, e.g. "with timed_span('save'): prs.save(path)"
+@contextlib.contextmanager
+def timed_span(stage, **labels):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start_time, labels)
+
+# Decorator adding a Dash callback's latency to the callback histogram
+def timed_callback(callback):
+    @functools.wraps(callback)
+    def timed(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            observe_latency('kpi_report_callback_seconds', {'callback': callback.__name__},
+                            time.perf_counter() - start_time)
+    return timed
+
+# Input files: sales data and the pre-edited ppt template with placeholders
+DATA_PATH = 'online_sales.csv'
+TEMPLATE_PATH = "Sales_presentation1.pptx"
+
+# Typed columnar copy of the CSV plus its presorted age index, rebuilt whenever
+# the CSV changes and memory-mapped by every process that loads the data. The
+# columns are NumPy views straight onto the mapped file, so any number of
+# gunicorn workers share one copy of the rows through the page cache.
+COLUMNAR_PATH = 'online_sales.feather'
+SALES_DTYPES = {
+    'age': 'uint8',
+    'new_user': 'bool',
+    'total_pages_visited': 'uint16',
+    'converted': 'bool'
+}
+
+# Version of the columnar file layout, older files are rebuilt
+COLUMNAR_LAYOUT = b'2'
+
+# Function to fingerprint a file from its modification time and size
+def get_file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'missing'
+    return str(stat.st_mtime_ns) + "-" + str(stat.st_size)
+
+# Function to convert the CSV once into a typed, uncompressed Feather file
+def build_columnar_store(data_path, columnar_path):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    
+    df = pd.read_csv(data_path, delimiter = ',', dtype=SALES_DTYPES)
+    age_index = build_age_index(df)
+    columns = {}
+    for name, dtype in SALES_DTYPES.items():
+        # Arrow packs booleans into bits, stored as bytes they can be viewed without a copy
+        columns[name] = pa.array(df[name].to_numpy().astype('uint8' if dtype == 'bool' else dtype))
+    columns['age_order'] = pa.array(age_index['order'].astype('uint32' if len(df) < 2 ** 32 else 'int64'))
+    columns['sorted_age'] = pa.array(age_index['sorted_ages'])
+    table = pa.table(columns)
+    # Remember which version of the CSV this file was built from
+    table = table.replace_schema_metadata({'source_fingerprint': get_file_fingerprint(data_path),
+                                           'layout': COLUMNAR_LAYOUT})
+    
+    temp_path = columnar_path + "." + str(os.getpid()) + ".tmp"
+    # One chunk per column, so every column is a single contiguous buffer in the file
+    feather.write_feather(table, temp_path, compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(temp_path, columnar_path)
+    logger.info("Columnar store rebuilt: %s", columnar_path)
+
+# Function to map the columnar copy and return its columns as read-only NumPy views
+def open_columnar_store(data_path, columnar_path):
+    import pyarrow.feather as feather
+    
+    source_fingerprint = get_file_fingerprint(data_path).encode('utf-8')
+    table = None
+    if os.path.exists(columnar_path):
+        table = feather.read_table(columnar_path, memory_map=True)
+        metadata = table.schema.metadata or {}
+        if metadata.get(b'source_fingerprint') != source_fingerprint or metadata.get(b'layout') != COLUMNAR_LAYOUT:
+            table = None
+    
+    if table is None:
+        build_columnar_store(data_path, columnar_path)
+        table = feather.read_table(columnar_path, memory_map=True)
+    
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if column.num_chunks == 1:
+            columns[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            columns[name] = column.to_numpy()
+    return columns
+
+# Function to load the sales data and its presorted age index, mapping the
+# columnar copy when pyarrow is installed
+def load_indexed_sales_data(data_path=DATA_PATH, columnar_path=COLUMNAR_PATH):
+    try:
+        import pyarrow
+    except ImportError:
+        df1 = pd.read_csv(data_path, delimiter = ',', dtype=SALES_DTYPES)
+        return df1, build_age_index(df1)
+    
+    columns = open_columnar_store(data_path, columnar_path)
+    # copy=False keeps every column its own block on top of the mapped file
+    df1 = pd.DataFrame({name: columns[name].view(dtype) for name, dtype in SALES_DTYPES.items()}, copy=False)
+    return df1, {'order': columns['age_order'], 'sorted_ages': columns['sorted_age']}
+
+# Function to load the sales data
+def load_sales_data(data_path=DATA_PATH, columnar_path=COLUMNAR_PATH):
+    return load_indexed_sales_data(data_path, columnar_path)[0]
 
 # Function to get age categories from data
 def get_age_categories(df1):
     if df1.empty:
         return []
     # Get min and max ages, rounded down to nearest 5
-    min_age = (min(df1['age']) // 5) * 5
-    max_age = (max(df1['age']) // 5) * 5
+    min_age = (int(min(df1['age'])) // 5) * 5
+    max_age = (int(max(df1['age'])) // 5) * 5
     
     # Create age ranges in steps of 5
     age_bins = range(min_age, max_age + 6, 5)
@@ -44,8 +207,524 @@ def get_age_categories(df1):
     
     return result
 
+# Columns held by the aggregate cube (one row per age / new_user pair)
+CUBE_COLUMNS = ['age', 'new_user', 'count', 'total_pages_visited', 'converted']
+
+# Function to build the aggregate cube once at load time
+def build_age_cube(df1):
+    if df1.empty:
+        return pd.DataFrame({column: pd.Series(dtype='int64') for column in CUBE_COLUMNS})
+    cube = df1.groupby(['age', 'new_user'], sort=True).agg(
+        count=('age', 'size'),
+        total_pages_visited=('total_pages_visited', 'sum'),
+        converted=('converted', 'sum')
+    ).reset_index()
+    return cube[CUBE_COLUMNS].astype('int64')
+
+# Function to build the cube by streaming the CSV in bounded chunks
+# Only one chunk of rows is held in memory, so file size does not matter
+def build_age_cube_streaming(data_path, chunk_size):
+    totals = None
+    for chunk in pd.read_csv(data_path, delimiter = ',', dtype=SALES_DTYPES, chunksize=chunk_size):
+        chunk_cube = build_age_cube(chunk)
+        totals = chunk_cube if totals is None else merge_age_cubes(totals, chunk_cube)
+    
+    if totals is None:
+        return build_age_cube(pd.DataFrame(columns=list(SALES_DTYPES)))
+    return totals
+
+# Function to add two cubes together, e.g. the loaded data and newly appended rows
+def merge_age_cubes(cube, delta_cube):
+    # Integer sums per (age, new_user), exact however often cubes are merged
+    merged = pd.concat([cube, delta_cube]).groupby(['age', 'new_user'], sort=True).sum().reset_index()
+    return merged[CUBE_COLUMNS].astype('int64')
+
+# Function to make sure we are working with a cube and not raw rows
+def as_age_cube(data):
+    if 'count' in data.columns:
+        return data
+    return build_age_cube(data)
+
+# Function to turn selected categories (e.g. "25-29") into sorted, merged age ranges
+# Returns None when no age filtering is needed
+def parse_age_categories(selected_age_categories):
+    if not selected_age_categories or 'all' in selected_age_categories:
+        return None
+    if isinstance(selected_age_categories, str):
+        selected_age_categories = [selected_age_categories]
+
+    age_ranges = []
+    for category in selected_age_categories:
+        age_parts = category.split('-')
+        age_ranges.append((int(age_parts[0]), int(age_parts[1])))
+    age_ranges.sort()
+
+    # Merge touching or overlapping ranges so "25-29" + "30-34" becomes 25-34
+    merged_ranges = []
+    for min_age, max_age in age_ranges:
+        if merged_ranges and min_age <= merged_ranges[-1][1] + 1:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], max_age))
+        else:
+            merged_ranges.append((min_age, max_age))
+    return merged_ranges
+
+# Function to turn a selection into a canonical string, so the same ages picked
+# in a different order (or 'all' mixed with buckets) give the same key
+def get_selection_key(selected_age_categories):
+    age_ranges = parse_age_categories(selected_age_categories)
+    if age_ranges is None:
+        return 'all'
+    return ",".join(str(min_age) + "-" + str(max_age) for min_age, max_age in age_ranges)
+
+# Function to build a lookup table saying whether each age value is selected
+def build_age_lookup(age_ranges, max_age):
+    lookup = np.zeros(max_age + 1, dtype=bool)
+    for min_age, max_age_in_range in age_ranges:
+        lookup[max(min_age, 0):max_age_in_range + 1] = True
+    return lookup
+
+# Function to presort the age column once so ranges can be found with searchsorted
+def build_age_index(df1):
+    ages = df1['age'].to_numpy()
+    order = np.argsort(ages, kind='stable')
+    return {'order': order, 'sorted_ages': ages[order]}
+
+# Function to get the row positions for the selected ranges from the presorted index
+def select_age_rows(age_index, age_ranges):
+    sorted_ages = age_index['sorted_ages']
+    starts = np.searchsorted(sorted_ages, [min_age for min_age, _ in age_ranges], side='left')
+    ends = np.searchsorted(sorted_ages, [max_age for _, max_age in age_ranges], side='right')
+    positions = [age_index['order'][start:end] for start, end in zip(starts, ends)]
+    # Keep the original row order of the dataframe
+    return np.sort(np.concatenate(positions))
+
+# Function to keep only the cube rows that fall in the selected age categories
+def filter_cube_by_age(cube, selected_age_categories):
+    age_ranges = parse_age_categories(selected_age_categories)
+    if age_ranges is None or cube.empty:
+        return cube
+
+    ages = cube['age'].to_numpy()
+    lookup = build_age_lookup(age_ranges, int(ages.max()))
+    return cube[lookup[ages]]
+
+# Filters besides age: user type and bands of total_pages_visited (inclusive,
+# None = no upper bound). These need raw rows, see get_filtered_cube.
+USER_TYPES = {'new': True, 'returning': False}
+PAGE_BANDS = {
+    '1-2': (1, 2),
+    '3-5': (3, 5),
+    '6-9': (6, 9),
+    '10-14': (10, 14),
+    '15+': (15, None)
+}
+
+# Function to make sure we are working with a filter dict and not just age categories
+# Within a dimension the picked values are OR-ed, the dimensions are combined with
+# 'match' ('and' or 'or'); a dimension with nothing picked (or age 'all') is left out
+def as_filters(selection):
+    if isinstance(selection, dict):
+        filters = dict(selection)
+    else:
+        filters = {'age': selection}
+    filters['age'] = filters.get('age')
+    for dimension in ['user_type', 'pages']:
+        values = filters.get(dimension) or []
+        filters[dimension] = [values] if isinstance(values, str) else list(values)
+    filters['match'] = filters.get('match') or 'and'
+    return filters
+
+# Function to tell whether a selection filters on anything besides age
+def has_row_filters(selection):
+    filters = as_filters(selection)
+    return bool(filters['user_type'] or filters['pages'])
+
+# Function to turn a selection into a canonical string like get_selection_key,
+# with the user type and page band filters appended when there are any
+def get_filter_key(selection):
+    filters = as_filters(selection)
+    key = get_selection_key(filters['age'])
+    if not has_row_filters(filters):
+        return key
+    key_parts = [key,
+                 "user=" + ",".join(user_type for user_type in USER_TYPES if user_type in filters['user_type']),
+                 "pages=" + ",".join(band for band in PAGE_BANDS if band in filters['pages']),
+                 filters['match']]
+    return "|".join(key_parts)
+
+# Function to build the bitmap indexes: one packed bitmap (a bit per row) for every
+# 5-year age group, user type and page band, so any combination of filters is
+# answered with bitwise operations instead of scanning the rows again
+def build_bitmap_index(df1):
+    age_groups = (df1['age'].to_numpy() // 5) * 5
+    new_users = df1['new_user'].to_numpy()
+    pages = df1['total_pages_visited'].to_numpy()
+    
+    bitmaps = {'rows': len(df1), 'age': {}, 'user_type': {}, 'pages': {}}
+    for group_start in np.unique(age_groups):
+        bitmaps['age'][int(group_start)] = np.packbits(age_groups == group_start)
+    for user_type, is_new in USER_TYPES.items():
+        bitmaps['user_type'][user_type] = np.packbits(new_users == is_new)
+    for band, (min_pages, max_pages) in PAGE_BANDS.items():
+        in_band = pages >= min_pages
+        if max_pages is not None:
+            in_band &= pages <= max_pages
+        bitmaps['pages'][band] = np.packbits(in_band)
+    return bitmaps
+
+# Function to OR together the bitmaps of the picked values of one dimension
+def union_bitmaps(bitmaps, dimension, values):
+    result = np.zeros((bitmaps['rows'] + 7) // 8, dtype=np.uint8)
+    for value in values:
+        bitmap = bitmaps[dimension].get(value)
+        if bitmap is not None:
+            result |= bitmap
+    return result
+
+# Function to get the bitmap of the rows in the selected age ranges
+# Whole 5-year groups come from the index, other ranges from the presorted ages
+def get_age_bitmap(bitmaps, age_index, age_ranges):
+    result = np.zeros((bitmaps['rows'] + 7) // 8, dtype=np.uint8)
+    for min_age, max_age in age_ranges:
+        if min_age % 5 == 0 and (max_age + 1) % 5 == 0:
+            result |= union_bitmaps(bitmaps, 'age', range(min_age, max_age + 1, 5))
+        else:
+            mask = np.zeros(bitmaps['rows'], dtype=bool)
+            mask[select_age_rows(age_index, [(min_age, max_age)])] = True
+            result |= np.packbits(mask)
+    return result
+
+# Function to resolve a selection to the positions of the matching rows
+# Returns None when nothing is filtered
+def select_filtered_rows(bitmaps, age_index, selection):
+    filters = as_filters(selection)
+    dimension_bitmaps = []
+    age_ranges = parse_age_categories(filters['age'])
+    if age_ranges is not None:
+        dimension_bitmaps.append(get_age_bitmap(bitmaps, age_index, age_ranges))
+    for dimension in ['user_type', 'pages']:
+        if filters[dimension]:
+            dimension_bitmaps.append(union_bitmaps(bitmaps, dimension, filters[dimension]))
+    if not dimension_bitmaps:
+        return None
+    
+    result = dimension_bitmaps[0]
+    for bitmap in dimension_bitmaps[1:]:
+        if filters['match'] == 'or':
+            result |= bitmap
+        else:
+            result &= bitmap
+    return np.flatnonzero(np.unpackbits(result, count=bitmaps['rows']))
+
+# Function to aggregate the cube into 5-year age groups for the charts
+def get_age_group_stats(cube):
+    cube = cube[cube['count'] > 0]
+    if cube.empty:
+        return pd.DataFrame(columns=['AgeGroup', 'total_users', 'total_pages_visited', 'converted', 'conversion_rate'])
+
+    # Age ranges are rounded down to the nearest 5, as in get_age_categories
+    min_age = (int(cube['age'].min()) // 5) * 5
+    max_age = (int(cube['age'].max()) // 5) * 5
+    group_starts = list(range(min_age, max_age + 1, 5))
+
+    grouped = cube.groupby((cube['age'] // 5) * 5)[['count', 'total_pages_visited', 'converted']].sum()
+    grouped = grouped.reindex(group_starts, fill_value=0)
+
+    age_group_stats = pd.DataFrame({
+        'AgeGroup': [str(i) + "-" + str(i + 4) for i in group_starts],
+        'total_users': grouped['count'].to_numpy(),
+        'total_pages_visited': grouped['total_pages_visited'].to_numpy(),
+        'converted': grouped['converted'].to_numpy()
+    })
+    # Average conversion per user, left empty (NaN) for age groups without users
+    users = age_group_stats['total_users'].where(age_group_stats['total_users'] > 0)
+    age_group_stats['conversion_rate'] = age_group_stats['converted'] / users
+    return age_group_stats
+
+# Column types DuckDB reads the sales CSV with, matching SALES_DTYPES
+DUCKDB_COLUMNS = "{'age': 'UTINYINT', 'new_user': 'BOOLEAN', 'total_pages_visited': 'USMALLINT', 'converted': 'BOOLEAN'}"
+
+# Function to open an in-memory DuckDB connection using the configured number of threads
+def connect_duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("The 'duckdb' query backend needs the duckdb package: pip install duckdb")
+    connection = duckdb.connect()
+    connection.execute("SET threads TO " + str(app_config['query_threads'] or os.cpu_count() or 1))
+    return connection
+
+# Function to get the DuckDB table function reading the sales file (CSV or Parquet)
+def get_duckdb_source(data_path):
+    if data_path.lower().endswith('.parquet'):
+        return "read_parquet(?)"
+    return "read_csv(?, header = true, columns = " + DUCKDB_COLUMNS + ")"
+
+# Function to turn a selection (age categories or a filter dict) into a WHERE
+# clause plus its parameters, so DuckDB skips the other rows while scanning the file
+def get_filter_where_clause(selection):
+    filters = as_filters(selection)
+    conditions = []
+    params = []
+    age_ranges = parse_age_categories(filters['age'])
+    if age_ranges is not None:
+        conditions.append("(" + " OR ".join(["age BETWEEN ? AND ?"] * len(age_ranges)) + ")")
+        for min_age, max_age in age_ranges:
+            params += [min_age, max_age]
+    if filters['user_type']:
+        conditions.append("new_user IN (" + ", ".join(["?"] * len(filters['user_type'])) + ")")
+        params += [USER_TYPES[user_type] for user_type in filters['user_type']]
+    if filters['pages']:
+        band_conditions = []
+        for band in filters['pages']:
+            min_pages, max_pages = PAGE_BANDS[band]
+            if max_pages is None:
+                band_conditions.append("total_pages_visited >= ?")
+                params.append(min_pages)
+            else:
+                band_conditions.append("total_pages_visited BETWEEN ? AND ?")
+                params += [min_pages, max_pages]
+        conditions.append("(" + " OR ".join(band_conditions) + ")")
+    
+    if not conditions:
+        return "", []
+    joiner = " OR " if filters['match'] == 'or' else " AND "
+    return " WHERE " + joiner.join(conditions), params
+
+# Function to build the aggregate cube inside DuckDB, straight from the file
+# Only the cube comes back, so the file can be far larger than memory
+def query_age_cube_duckdb(data_path, selection=None):
+    where_clause, params = get_filter_where_clause(selection)
+    query = ("SELECT age, new_user, count(*) AS count,"
+             " sum(total_pages_visited) AS total_pages_visited,"
+             " sum(CAST(converted AS INTEGER)) AS converted"
+             " FROM " + get_duckdb_source(data_path) + where_clause +
+             " GROUP BY age, new_user ORDER BY age, new_user")
+    connection = connect_duckdb()
+    try:
+        cube = connection.execute(query, [data_path] + params).df()
+    finally:
+        connection.close()
+    return cube[CUBE_COLUMNS].astype('int64')
+
+# Runtime configuration, filled in by create_app
+DEFAULT_CONFIG = {
+    'data_path': DATA_PATH,
+    'columnar_path': COLUMNAR_PATH,
+    'template_path': TEMPLATE_PATH,
+    # 'memory' loads every row, 'stream' folds the CSV chunk by chunk into the
+    # aggregate cube for files larger than memory (raw rows are then not kept)
+    'ingest_mode': 'memory',
+    'chunk_size': 1000000,
+    # 'pandas' builds the cube in this process as set by ingest_mode, 'duckdb'
+    # runs the GROUP BY inside DuckDB against the CSV (or a .parquet data_path)
+    # on query_threads cores (None uses all of them) without loading the rows
+    'query_backend': 'pandas',
+    'query_threads': None,
+    # Poll the CSV for appended rows and refresh the dashboard (0 switches it off)
+    'live_refresh_ms': 5000,
+    # Dashboard results kept per selection; give an SQLite file to share them
+    # between worker processes (None keeps them in this process only)
+    'dashboard_cache_size': 128,
+    'dashboard_cache_path': None,
+    # Ship the age aggregate to the browser once and filter there, so changing
+    # the dropdown does not send a request to the server at all
+    'client_side_filtering': False,
+    # Directory keeping a copy of every exported report (None keeps none),
+    # trimmed by age and size as set by REPORT_SPOOL_MAX_AGE / _MAX_BYTES
+    'report_spool_dir': None,
+    # Directory of the report cache and of the files of running export jobs,
+    # trimmed by age and size as set by REPORT_CACHE_MAX_AGE / _MAX_BYTES
+    'report_cache_dir': 'report_cache',
+    # Load the data inside create_app, e.g. in the gunicorn master with --preload
+    # so the columnar copy is built once before the workers map it
+    'preload_data': False
+}
+app_config = dict(DEFAULT_CONFIG)
+
+# Settings the loaded dataset depends on, changing one of them drops it
+DATASET_SETTINGS = ['data_path', 'columnar_path', 'ingest_mode', 'chunk_size', 'query_backend', 'query_threads']
+
+# Dataset loaded on first use: raw rows, the aggregate cube every callback is
+# answered from, and the presorted age index for callers that need raw rows
+# (frame and age_index are None in streaming mode and with the duckdb
+# backend). Rows appended to the CSV
+# later are folded into the cube and kept in 'appended', apart from the loaded
+# frame; 'bitmaps' holds the bitmap indexes of the loaded frame, built the first
+# time a filter besides age is used, and 'tail' the appended rows with their own
+# indexes (see get_indexed_sales_parts); 'offset' is how far into the CSV we have read, 'base'
+# fingerprints the file as loaded, 'marker' tells whether the bytes read so far
+# are still the same (see get_read_marker) and 'version' changes whenever the data does.
+dataset = None
+dataset_lock = threading.Lock()
+
+# Bytes before the read offset compared on every refresh, so a file replaced by
+# a different one is noticed even when the new file is larger
+READ_MARKER_BYTES = 4096
+
+# Function to identify the data read so far: the file itself (device and inode)
+# plus a hash of the last bytes before offset
+def get_read_marker(data_path, offset):
+    stat = os.stat(data_path)
+    start = max(0, offset - READ_MARKER_BYTES)
+    with open(data_path, 'rb') as f:
+        f.seek(start)
+        tail = f.read(offset - start)
+    return [stat.st_dev, stat.st_ino, hashlib.sha256(tail).hexdigest()]
+
+# Function to load the dataset from the configured CSV
+def load_dataset():
+    data_path = app_config['data_path']
+    # Rows appended from here on are picked up by refresh_dataset
+    offset = os.path.getsize(data_path)
+    base_fingerprint = get_file_fingerprint(data_path)
+    df1 = None
+    age_index = None
+    if app_config['query_backend'] == 'duckdb':
+        cube = query_age_cube_duckdb(data_path)
+    elif app_config['ingest_mode'] == 'stream':
+        cube = build_age_cube_streaming(data_path, app_config['chunk_size'])
+    else:
+        df1, age_index = load_indexed_sales_data(data_path, app_config['columnar_path'])
+        cube = build_age_cube(df1)
+    return {
+        'frame': df1,
+        'cube': cube,
+        'age_index': age_index,
+        'bitmaps': None,
+        'appended': [],
+        'tail': None,
+        'offset': offset,
+        'base': base_fingerprint,
+        'marker': get_read_marker(data_path, offset),
+        'version': get_data_version(data_path, base_fingerprint, offset)
+    }
+
+# Function to name the state of the data: the file as it was loaded plus how far
+# it has been read, so every worker that read the same rows gets the same token
+def get_data_version(data_path, base_fingerprint, offset):
+    version_parts = [os.path.abspath(data_path), base_fingerprint, offset]
+    return hashlib.sha256(json.dumps(version_parts).encode('utf-8')).hexdigest()[:16]
+
+# Function to get the dataset, loading it the first time it is needed
+def get_dataset():
+    global dataset
+    with dataset_lock:
+        if dataset is None:
+            dataset = load_dataset()
+        return dataset
+
+# Function to pick up rows appended to the CSV since the last read
+# Only the new bytes are parsed and applied to the cube as a delta
+# Returns True when the data changed
+def refresh_dataset():
+    global dataset
+    data = get_dataset()
+    with dataset_lock:
+        data_path = app_config['data_path']
+        size = os.path.getsize(data_path)
+        if size == data['offset']:
+            return False
+        
+        # The file was truncated, replaced or rewritten, start again from scratch
+        # (a Parquet file has no appended rows, it is always rewritten as a whole)
+        if (size < data['offset'] or data_path.lower().endswith('.parquet')
+                or get_read_marker(data_path, data['offset']) != data['marker']):
+            logger.warning("Sales data was rewritten, reloading: %s", data_path)
+            dataset = load_dataset()
+            return True
+        
+        with open(data_path, 'rb') as f:
+            f.seek(data['offset'])
+            new_bytes = f.read(size - data['offset'])
+        
+        # Leave a half-written last line for the next refresh
+        last_newline = new_bytes.rfind(b'\n')
+        if last_newline < 0:
+            return False
+        new_bytes = new_bytes[:last_newline + 1]
+        
+        try:
+            new_rows = pd.read_csv(io.BytesIO(new_bytes), delimiter = ',', header=None,
+                                   names=list(SALES_DTYPES), dtype=SALES_DTYPES)
+        except ValueError as e:
+            # Not rows in our format, most likely a different file: read it all again
+            logger.warning("Could not parse appended rows (%s), reloading: %s", e, data_path)
+            dataset = load_dataset()
+            return True
+        data['offset'] += len(new_bytes)
+        data['marker'] = get_read_marker(data_path, data['offset'])
+        if new_rows.empty:
+            return False
+        
+        data['cube'] = merge_age_cubes(data['cube'], build_age_cube(new_rows))
+        if data['frame'] is not None:
+            data['appended'].append(new_rows)
+            data['tail'] = None
+        data['version'] = get_data_version(data_path, data['base'], data['offset'])
+        logger.info("Applied %d appended rows from %s", len(new_rows), data_path)
+        return True
+
+# Function to get the aggregate cube of the loaded dataset
+def get_age_cube():
+    return get_dataset()['cube']
+
+# Function to get the raw rows with their age and bitmap indexes, as a list of
+# (frame, age_index, bitmaps): the rows as loaded, then the rows appended since.
+# The loaded rows are indexed once; appended rows get a small index of their own,
+# rebuilt when more rows come in, so a refresh never re-sorts the whole frame
+# (raw rows are not available in streaming mode or with the duckdb backend)
+def get_indexed_sales_parts():
+    data = get_dataset()
+    with dataset_lock:
+        if data['frame'] is None:
+            raise ValueError("Raw rows are not kept in streaming ingest mode or with the duckdb backend")
+        if data['bitmaps'] is None:
+            data['bitmaps'] = build_bitmap_index(data['frame'])
+        parts = [(data['frame'], data['age_index'], data['bitmaps'])]
+        if data['appended']:
+            if data['tail'] is None:
+                tail_frame = pd.concat(data['appended'], ignore_index=True)
+                data['appended'] = [tail_frame]
+                data['tail'] = (tail_frame, build_age_index(tail_frame), build_bitmap_index(tail_frame))
+            parts.append(data['tail'])
+        return parts
+
+# Function to check whether filters besides age can be used: they need the raw
+# rows (memory ingest) or the duckdb backend, and the browser only has the age cube
+def supports_row_filters():
+    if app_config['query_backend'] == 'duckdb':
+        return not app_config['client_side_filtering']
+    return app_config['ingest_mode'] != 'stream' and not app_config['client_side_filtering']
+
+# Function to get the raw rows of a selection with the bitmap indexes
+# (the duckdb backend never gets here, see get_filtered_cube)
+def select_sales_rows(selection):
+    # Each part is filtered with its own indexes and the matching rows put together
+    selected_parts = []
+    for df1, age_index, bitmaps in get_indexed_sales_parts():
+        positions = select_filtered_rows(bitmaps, age_index, selection)
+        selected_parts.append(df1 if positions is None else df1.iloc[positions])
+    if len(selected_parts) == 1:
+        return selected_parts[0]
+    return pd.concat(selected_parts, ignore_index=True)
+
+# Function to get the cube for a selection: age-only selections filter the cube,
+# the other filters are resolved with the bitmap indexes (or pushed down to
+# DuckDB) and the cube is rebuilt from the matching rows
+def get_filtered_cube(cube, selection):
+    if not has_row_filters(selection):
+        return filter_cube_by_age(cube, as_filters(selection)['age'])
+    if app_config['query_backend'] == 'duckdb':
+        return query_age_cube_duckdb(app_config['data_path'], selection)
+    if app_config['ingest_mode'] == 'stream':
+        raise ValueError("Filtering by user type or pages needs the raw rows, not kept in streaming ingest mode")
+    return build_age_cube(select_sales_rows(selection))
+
 # Function to define ppt layout and specifications (where KPIs are placed)
 def set_custom_fill_and_outline(shape, is_large_rectangle = False):
+    from pptx.dml.color import RGBColor
+    
     if is_large_rectangle:
         fill_color = RGBColor(244,244,244)
     else:
@@ -54,21 +733,28 @@ def set_custom_fill_and_outline(shape, is_large_rectangle = False):
     shape.fill.fore_color.rgb = fill_color 
     shape.line.color.rgb = fill_color 
 
+#Function to calculate the conversion rate KPI (percent, 2 decimals)
+def get_conversion_rate(total_converted, total_pages_visited):
+    return round((total_converted/total_pages_visited)*100,2) if total_pages_visited > 0 else 0
+
 #Function to calculate KPIs 
-def calculate_kpis(df1):
-    if df1.empty: 
+def calculate_kpis(cube):
+    cube = as_age_cube(cube)
+    if cube.empty:
         return 0,0,0
-    
-    total_new_users = df1['new_user'].sum()
-    total_converted = df1['converted'].sum()
-    total_pages_visited = df1['total_pages_visited'].sum()
-    total_conversion = df1['converted'].sum()
-    conversion_rate = round((total_conversion/total_pages_visited)*100,2) if total_pages_visited > 0 else 0
+
+    total_new_users = int((cube['count'] * cube['new_user']).sum())
+    total_converted = int(cube['converted'].sum())
+    total_pages_visited = int(cube['total_pages_visited'].sum())
+    conversion_rate = get_conversion_rate(total_converted, total_pages_visited)
 
     return total_new_users, total_converted, conversion_rate
 
 #Function to add KPI metrics to slides
 def add_kpi(slide, left, top, value, label):
+    from pptx.util import Inches, Pt
+    from pptx.dml.color import RGBColor
+    
     text_box = slide.shapes.add_textbox(left, top, Inches(2), Inches(1))
     text_frame = text_box.text_frame
     text_frame.clear()
@@ -86,6 +772,9 @@ def add_kpi(slide, left, top, value, label):
 
 #Function to add the Key statistics heading
 def add_heading_text(slide, left, top, text):
+    from pptx.util import Inches, Pt
+    from pptx.enum.text import PP_ALIGN
+    
     textbox = slide.shapes.add_textbox(left, top, Inches(3), Inches(0.5))
     text_frame = textbox.text_frame
     text_frame.text = text
@@ -97,9 +786,21 @@ def add_heading_text(slide, left, top, text):
 
 #Function to clone shapes from source slide 
 def clone_shapes(source_slide, new_slide):
+    from pptx.util import Inches
+    from pptx.enum.shapes import MSO_SHAPE, MSO_SHAPE_TYPE
+    
     for shape in source_slide.shapes:
         if not shape.is_placeholder:
-            if shape.shape_type == MSO_SHAPE.RECTANGLE:
+            # Shapes holding a template token (text boxes, but also e.g. KPI cards
+            # drawn as rectangles) are copied with their text and formatting,
+            # under a shape id of the new slide
+            is_token = shape.has_text_frame and shape.text_frame.text.strip() in TEMPLATE_BINDINGS
+            if is_token or shape.shape_type == MSO_SHAPE_TYPE.TEXT_BOX:
+                new_element = copy.deepcopy(shape._element)
+                new_element.nvSpPr.cNvPr.id = new_slide.shapes._next_shape_id
+                new_slide.shapes._spTree.insert_element_before(new_element, 'p:extLst')
+            
+            elif shape.shape_type == MSO_SHAPE.RECTANGLE:
                 new_shape = new_slide.shapes.add_shape(
                     shape.auto_shape_type,
                     shape.left,
@@ -137,7 +838,11 @@ def clone_shapes(source_slide, new_slide):
                 )
 
 # Improved function to check if Inkscape is available
+# The probe spawns a process, so the answer is kept for the life of the process
+@functools.lru_cache(maxsize=None)
 def is_inkscape_available():
+    import subprocess
+    
     try:
         with open(os.devnull, 'w') as devnull:
             subprocess.run(["inkscape", "--version"], 
@@ -146,471 +851,769 @@ def is_inkscape_available():
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
-# Improved function to convert SVG to EMF with fallback
-def convert_svg_to_emf(svg_path, emf_path):
-    if not os.path.exists(svg_path):
-        print("SVG file not found:",svg_path)
-        return None
-        
-    # Check if Inkscape is available for error handling
-    if is_inkscape_available():
+# Export charts as EMF (vector) through Inkscape when it is installed, PNG otherwise
+VECTOR_CHARTS = True
+
+# Long-lived "inkscape --shell" worker so conversions do not pay Inkscape's startup
+# The shell talks over pipes with select(), which is only available on POSIX
+INKSCAPE_SHELL = os.name != 'nt'
+INKSCAPE_TIMEOUT = 60
+inkscape_shell = None
+inkscape_shell_lock = threading.Lock()
+# Set when the shell could not be started (e.g. Inkscape 0.92 without the 1.x
+# actions), so later exports convert one by one instead of waiting again
+inkscape_shell_failed = False
+
+class InkscapeShell:
+    def __init__(self):
+        import subprocess
+        
+        self.owner_pid = os.getpid()
+        self.workdir = tempfile.mkdtemp(prefix='inkscape_shell_')
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(
+            ["inkscape", "--shell"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        # Wait for the banner and the first prompt
         try:
-            with open(os.devnull, 'w') as devnull:
-                subprocess.run(
-                    ["inkscape", svg_path, "export-type=emf", "export-filename", emf_path],
-                    check=True,
-                    stdout=devnull,
-                    stderr=devnull
-                )
-            if os.path.exists(emf_path):
-                print("Successfully converted to EMF:", emf_path)
-                return emf_path
-        except subprocess.CalledProcessError as e:
-            print("Error converting SVG to EMF:", e)
-    
-    # Fallback: convert to PNG using matplotlib
-    print("Inkscape not available or conversion failed. Using PNG fallback")
-    png_path = svg_path.replace('.svg', '.png')
+            self.read_until_prompt()
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            raise
+
+    def is_alive(self):
+        return self.owner_pid == os.getpid() and self.process.poll() is None
+
+    # Read the shell output until Inkscape prints its "> " prompt again
+    def read_until_prompt(self):
+        output = b''
+        deadline = time.monotonic() + INKSCAPE_TIMEOUT
+        stdout_fd = self.process.stdout.fileno()
+        while not output.endswith(b'> '):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Inkscape shell did not answer in " + str(INKSCAPE_TIMEOUT) + "s")
+            ready, _, _ = select.select([stdout_fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(stdout_fd, 4096)
+            if not chunk:
+                raise RuntimeError("Inkscape shell exited")
+            output += chunk
+        return output
+
+    # Convert a batch of SVG documents with a single command line
+    # Returns one EMF bytes object (or None if that one failed) per input
+    def convert_batch(self, svg_list):
+        with self.lock:
+            jobs = []
+            actions = []
+            for svg_data in svg_list:
+                job_name = uuid.uuid4().hex
+                svg_path = os.path.join(self.workdir, job_name + '.svg')
+                emf_path = os.path.join(self.workdir, job_name + '.emf')
+                with open(svg_path, 'wb') as f:
+                    f.write(svg_data)
+                jobs.append((svg_path, emf_path))
+                actions.append("file-open:" + svg_path + ";export-type:emf;export-filename:" + emf_path + ";export-do;file-close")
+            
+            try:
+                self.process.stdin.write((";".join(actions) + "\n").encode('utf-8'))
+                self.process.stdin.flush()
+                self.read_until_prompt()
+                
+                results = []
+                for svg_path, emf_path in jobs:
+                    if os.path.exists(emf_path):
+                        with open(emf_path, 'rb') as f:
+                            results.append(f.read())
+                    else:
+                        results.append(None)
+                return results
+            finally:
+                for svg_path, emf_path in jobs:
+                    for path in (svg_path, emf_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+
+    def close(self):
+        if self.owner_pid != os.getpid():
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write(b"quit\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+# Function to get the shared Inkscape shell, starting it on first use
+def get_inkscape_shell():
+    global inkscape_shell, inkscape_shell_failed
+    with inkscape_shell_lock:
+        # Forked workers start their own shell instead of sharing the parent's pipes
+        if inkscape_shell is None or not inkscape_shell.is_alive():
+            if inkscape_shell_failed:
+                raise RuntimeError("Inkscape shell could not be started earlier")
+            try:
+                inkscape_shell = InkscapeShell()
+            except Exception:
+                inkscape_shell_failed = True
+                raise
+        return inkscape_shell
+
+# Function to stop the Inkscape shell when the process exits
+def close_inkscape_shell():
+    global inkscape_shell
+    with inkscape_shell_lock:
+        if inkscape_shell is not None:
+            inkscape_shell.close()
+            inkscape_shell = None
+
+atexit.register(close_inkscape_shell)
+
+# Function to convert a single SVG with a one-off Inkscape process
+def convert_svg_to_emf_once(svg_data):
+    import subprocess
+    
     try:
-        # Re-generate the plot as PNG directly
-        return png_path 
-    except Exception as e:
-        print("Error in PNG fallback:",e)
+        # Inkscape reads the SVG from stdin and writes the EMF to stdout
+        with open(os.devnull, 'w') as devnull:
+            completed = subprocess.run(
+                ["inkscape", "--pipe", "--export-type=emf", "--export-filename=-"],
+                input=svg_data,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=devnull,
+                timeout=INKSCAPE_TIMEOUT
+            )
+        return completed.stdout or None
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.warning("Error converting SVG to EMF: %s", e)
         return None
 
-def generate_total_sites_chart(df1, title_suffix=""):
-    try:
-        # Check if we have any data to work with
-        if df1.empty:
-            print("DataFrame is empty, cannot generate chart")
-            return None
-        
-        # Calculate age ranges 
-        min_age = (min(df1['age']) // 5) * 5
-        max_age = (max(df1['age']) // 5) * 5
-        age_bins = range(min_age, max_age + 6, 5)
-        age_labels = []
-        for i in age_bins[:-1]:
-            label = str(i) + "-" + str(i + 4)
-            age_labels.append(label)
-        
-        # Work with a copy to avoid modifying the original dataframe
-        df1_copy = df1.copy()
-        
-        # Create age groups using pandas cut function
-        df1_copy['AgeGroup'] = pd.cut(df1_copy['age'], bins=age_bins, labels=age_labels, right=False)
-        
-        # Group by age and sum up total pages visited
-        age_group_stats = df1_copy.groupby('AgeGroup')['total_pages_visited'].sum().reset_index()
-        
-        # Set up the plot
-        plt.figure(figsize=(10, 6))
-        bars = plt.bar(age_group_stats['AgeGroup'], age_group_stats['total_pages_visited'],
-                       color='skyblue', edgecolor='black')
-        
-        # Add numbers on top of each bar
-        for bar in bars:
-            height = bar.get_height()
-            x_pos = bar.get_x() + bar.get_width() / 2.0
-            plt.text(x_pos, height, str(int(height)), ha='center', va='bottom')
+# Function to convert a batch of SVGs to EMF, None for the ones that failed
+def convert_svgs_to_emf(svg_list):
+    if not svg_list or not is_inkscape_available():
+        return [None] * len(svg_list)
+    
+    with timed_span('svg_to_emf'):
+        if INKSCAPE_SHELL and not inkscape_shell_failed:
+            try:
+                return get_inkscape_shell().convert_batch(svg_list)
+            except Exception as e:
+                # Drop the broken shell, the next batch starts a new one
+                logger.warning("Inkscape shell failed, converting one by one: %s", e)
+                close_inkscape_shell()
         
-        # Set up the title
-        if title_suffix:
-            title = "Total pages visited vs Age group " + title_suffix
+        return [convert_svg_to_emf_once(svg_data) for svg_data in svg_list]
+
+# Improved function to convert SVG to EMF, everything stays in memory
+def convert_svg_to_emf(svg_data):
+    if not svg_data:
+        logger.warning("SVG data is empty, nothing to convert")
+        return None
+    
+    emf_data = convert_svgs_to_emf([svg_data])[0]
+    if emf_data:
+        logger.debug("Successfully converted to EMF")
+        return emf_data
+    
+    logger.info("Inkscape not available or conversion failed. Using PNG fallback")
+    return None
+
+# Worker pools start their processes with 'spawn': forking from a threaded
+# server would copy the locks other threads hold at that moment (metrics,
+# dataset, template registry) into the child, where nobody ever releases them
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+# Charts are drawn with the object-oriented Figure API on the Agg canvas,
+# so they never touch pyplot's global state and can render in several
+# processes at once. Agg holds the GIL while it draws, so threads would not
+# help. CHART_WORKERS = 0 renders in the calling process.
+CHART_WORKERS = 2
+chart_pool = None
+chart_pool_lock = threading.Lock()
+
+# Function to save a figure into bytes (SVG for vector output, PNG otherwise)
+def save_figure(fig, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'svg':
+        fig.savefig(buffer, format='svg', bbox_inches='tight', dpi=600, transparent=True)
+    else:
+        fig.savefig(buffer, format='png', bbox_inches='tight', dpi=300, transparent=True)
+    return buffer.getvalue()
+
+# Function to draw the average conversion rate chart on a new figure
+def draw_conversion_chart(age_group_stats, title_suffix=""):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    
+    age_labels = age_group_stats['AgeGroup'].tolist()
+    ax.bar(age_labels, age_group_stats['conversion_rate'], 
+           color='#003060', edgecolor='black')
+    
+    # Set up the title
+    if title_suffix:
+        title = "Average conversion rate vs Age group " + title_suffix
+    else:
+        title = "Average conversion rate vs Age group"
+    title = title.strip()
+    
+    # Customize the chart
+    ax.set_title(title, fontsize=14, pad=20)
+    ax.set_xlabel('Age Group (5-year ranges)', fontsize=12)
+    ax.set_ylabel('Conversion Rate (%)', fontsize=12)
+    ax.grid(axis='y', linestyle='', alpha=0.3)
+    ax.set_xticks(range(len(age_labels)))
+    ax.set_xticklabels(age_labels, rotation=45, ha='right')
+    fig.tight_layout()
+    
+    # Remove chart borders
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+    ax.spines['bottom'].set_visible(True)
+    return fig
+
+# Function to draw the total users chart on a new figure
+def draw_total_sites_chart(age_group_counts, title_suffix=""):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    
+    age_labels = age_group_counts['AgeGroup'].tolist()
+    ax.bar(age_labels, age_group_counts['total_users'], 
+           color='#00008B', edgecolor='black')
+    
+    # Build the title
+    if title_suffix:
+        title = "Total Users by Age Group " + title_suffix
+    else:
+        title = "Total Users by Age Group"
+    title = title.strip()
+    
+    # Customize the plot
+    ax.set_title(title, fontsize=14, pad=20)
+    ax.set_xlabel('Age Group (5-year ranges)', fontsize=12)
+    ax.set_ylabel('Total Users', fontsize=12)
+    ax.grid(axis='y', linestyle='', alpha=0.3)
+    ax.set_xticks(range(len(age_labels)))
+    ax.set_xticklabels(age_labels, rotation=45, ha='right')
+    fig.tight_layout()
+    return fig
+
+# Charts that can be rendered for a report, by name
+CHART_DRAWERS = {
+    'total_sites': draw_total_sites_chart,
+    'conversion': draw_conversion_chart
+}
+
+# Function to render one chart to bytes, runs in the chart pool
+def render_chart(chart_name, age_group_stats, title_suffix="", image_format='png'):
+    fig = CHART_DRAWERS[chart_name](age_group_stats, title_suffix)
+    return save_figure(fig, image_format)
+
+# Function to create the chart process pool on first use
+def get_chart_pool():
+    global chart_pool
+    with chart_pool_lock:
+        if chart_pool is None:
+            # Export and batch workers get their own pool too: process pool
+            # workers are not daemonic, so they may start spawned children
+            chart_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=POOL_CONTEXT)
+            # A worker process joins its children when it exits, so stop the pool
+            # first, before the queues it talks through are closed (priority 10)
+            multiprocessing.util.Finalize(None, close_chart_pool, exitpriority=100)
+        return chart_pool
+
+# Function to stop the chart pool and its processes
+def close_chart_pool():
+    global chart_pool
+    with chart_pool_lock:
+        if chart_pool is not None:
+            chart_pool.shutdown()
+            chart_pool = None
+
+# Function to render several charts for one report in parallel
+# Returns a dict of chart name -> in-memory buffer (None if the chart has no data)
+def render_report_charts(cube, chart_names, title_suffix="", vector=False, age_group_stats=None):
+    if age_group_stats is None:
+        age_group_stats = get_age_group_stats(as_age_cube(cube))
+    if age_group_stats.empty:
+        logger.warning("DataFrame is empty, cannot generate charts")
+        return {chart_name: None for chart_name in chart_names}
+    
+    # SVG is only rendered when vector output was asked for and can be converted
+    image_format = 'svg' if vector and is_inkscape_available() else 'png'
+    
+    rendered = {}
+    if CHART_WORKERS > 0 and len(chart_names) > 1:
+        try:
+            pool = get_chart_pool()
+            start_time = time.perf_counter()
+            futures = {chart_name: pool.submit(render_chart, chart_name, age_group_stats, title_suffix, image_format)
+                       for chart_name in chart_names}
+            for chart_name, future in futures.items():
+                rendered[chart_name] = future.result()
+                record_span('chart_render', time.perf_counter() - start_time, {'chart': chart_name})
+        except Exception as e:
+            logger.warning("Chart pool failed, rendering in this process: %s", e)
+            rendered = {}
+    for chart_name in chart_names:
+        if chart_name not in rendered:
+            with timed_span('chart_render', chart=chart_name):
+                rendered[chart_name] = render_chart(chart_name, age_group_stats, title_suffix, image_format)
+    
+    if image_format == 'png':
+        return {chart_name: io.BytesIO(rendered[chart_name]) for chart_name in chart_names}
+    
+    # Convert all SVGs in one batch, charts that fail fall back to PNG
+    emf_list = convert_svgs_to_emf([rendered[chart_name] for chart_name in chart_names])
+    chart_buffers = {}
+    for chart_name, emf_data in zip(chart_names, emf_list):
+        if emf_data:
+            chart_buffers[chart_name] = io.BytesIO(emf_data)
         else:
-            title = "Total pages visited vs Age group"
-        title = title.strip()
-        
-        # Customize the chart appearance
-        plt.title(title, fontsize=14, pad=20)
-        plt.xlabel('Age Group (5-year ranges)', fontsize=12)
-        plt.ylabel('Total Pages Visited', fontsize=12)
-        plt.grid(axis='y', linestyle='', alpha=0.7)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        
-        # Remove chart borders/spines
-        ax = plt.gca()
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.spines['bottom'].set_visible(True)  # Keep x-axis visible
-        
-        # Set up file paths
-        svg_path = 'temp_chart.svg'
-        emf_path = 'output_chart.emf'
-        png_path = 'output_chart.png'
-        
-        # Save as SVG first
-        plt.savefig(svg_path, format='svg', bbox_inches='tight', dpi=600, transparent=True)
-        
-        # Try to convert SVG to EMF format
-        result_path = convert_svg_to_emf(svg_path, emf_path)
-        
-        # Check if EMF conversion worked
-        if result_path is None or not os.path.exists(result_path):
-            # EMF didn't work, use PNG instead
-            print("Using PNG fallback...")
-            plt.savefig(png_path, format='png', bbox_inches='tight', dpi=300, transparent=True)
-            plt.close()
-            
-            # Clean up the temporary SVG file
-            if os.path.exists(svg_path):
-                os.remove(svg_path)
-            
-            # Check if PNG was created successfully
-            if os.path.exists(png_path):
-                print("Chart saved as PNG: " + png_path)
-                return png_path
-            else:
-                print("Failed to save PNG chart")
-                return None
-        
-        # EMF worked, close the plot and clean up
-        plt.close()
-        print("Chart saved as EMF: ", result_path)
-        return result_path
+            logger.info("Using PNG fallback for %s chart", chart_name)
+            chart_buffers[chart_name] = io.BytesIO(render_chart(chart_name, age_group_stats, title_suffix, 'png'))
+    return chart_buffers
+
+def generate_conversion_chart(cube, title_suffix="", vector=False):
+    try:
+        chart_buffer = render_report_charts(cube, ['conversion'], title_suffix, vector)['conversion']
+        if chart_buffer is not None:
+            logger.debug("Conversion chart rendered in memory")
+        return chart_buffer
     
     except Exception as e:
-        print("Error generating chart: " + str(e))
-        plt.close()  # Make sure to close plot even if something went wrong
+        logger.error("Error generating conversion chart: %s", e)
         return None
 
-def generate_conversion_chart(df1, title_suffix=""):
+
+def generate_total_sites_chart(cube, title_suffix="", vector=False):
     try:
-        # Check if we have data to work with
-        if df1.empty:
-            print("DataFrame is empty, cannot generate chart")
-            return None
-        
-        # Calculate age ranges - round down to nearest 5
-        min_age = (min(df1['age']) // 5) * 5
-        max_age = (max(df1['age']) // 5) * 5
-        age_bins = range(min_age, max_age + 6, 5)
-        age_labels = []
-        for i in age_bins[:-1]:
-            label = str(i) + "-" + str(i + 4)
-            age_labels.append(label)
-        
-        # Work with a copy to avoid modifying original dataframe
-        df1_copy = df1.copy()
-        df1_copy['AgeGroup'] = pd.cut(df1_copy['age'], bins=age_bins, labels=age_labels, right=False)
-        
-        # Calculate average conversion rate by age group
-        age_group_stats = df1_copy.groupby('AgeGroup')['converted'].mean().reset_index()
-        
-        # Create the plot
-        plt.figure(figsize=(10, 6))
-        bars = plt.bar(age_group_stats['AgeGroup'], age_group_stats['converted'], 
-                      color='#003060', edgecolor='black')
-        
-        # Set up the title
-        if title_suffix:
-            title = "Average conversion rate vs Age group " + title_suffix
-        else:
-            title = "Average conversion rate vs Age group"
-        title = title.strip()
-        
-        # Customize the chart
-        plt.title(title, fontsize=14, pad=20)
-        plt.xlabel('Age Group (5-year ranges)', fontsize=12)
-        plt.ylabel('Conversion Rate (%)', fontsize=12)
-        plt.grid(axis='y', linestyle='', alpha=0.3)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        
-        # Remove chart borders
-        ax = plt.gca()
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.spines['bottom'].set_visible(True)
-        
-        # Set up file paths
-        svg_path = 'temp_conversion_chart.svg'
-        emf_path = 'conversion_chart.emf'
-        png_path = 'conversion_chart.png'
-        
-        # Save as SVG first
-        plt.savefig(svg_path, format='svg', bbox_inches='tight', dpi=600, transparent=True)
-        
-        # Try to convert to EMF
-        result_path = convert_svg_to_emf(svg_path, emf_path)
-        
-        # Check if EMF conversion worked
-        if result_path is None or not os.path.exists(result_path):
-            # Use PNG as fallback
-            print("Using PNG fallback for conversion chart...")
-            plt.savefig(png_path, format='png', bbox_inches='tight', dpi=300, transparent=True)
-            plt.close()
-            
-            # Clean up temporary SVG file
-            if os.path.exists(svg_path):
-                os.remove(svg_path)
-            
-            # Check if PNG was created successfully
-            if os.path.exists(png_path):
-                print("Conversion chart saved as PNG: " + png_path)
-                return png_path
-            else:
-                print("Failed to save PNG conversion chart")
-                return None
-        
-        # EMF worked, clean up and return
-        plt.close()
-        print("Conversion chart saved as EMF: " + result_path)
-        return result_path
+        chart_buffer = render_report_charts(cube, ['total_sites'], title_suffix, vector)['total_sites']
+        if chart_buffer is not None:
+            logger.debug("Total sites chart rendered in memory")
+        return chart_buffer
     
     except Exception as e:
-        print("Error generating conversion chart: " + str(e))
-        plt.close() 
+        logger.error("Error generating total sites chart: %s", e)
         return None
 
+# Chart backend for reports: 'native' writes editable PowerPoint charts with the
+# data embedded, 'matplotlib' embeds rendered images (EMF through Inkscape or PNG)
+CHART_BACKEND = 'native'
 
-def generate_total_sites_chart(df1, title_suffix=""):
-    try:
-        # Check if dataframe has data
-        if df1.empty:
-            print("DataFrame is empty, cannot generate total sites chart")
-            return None
-        
-        # Calculate age ranges
-        min_age = (min(df1['age']) // 5) * 5
-        max_age = (max(df1['age']) // 5) * 5
-        age_bins = range(min_age, max_age + 6, 5)
-        age_labels = []
-        for i in age_bins[:-1]:
-            label = str(i) + "-" + str(i + 4)
-            age_labels.append(label)
-        
-        # Work with copy of dataframe
-        df1_copy = df1.copy()
-        df1_copy['AgeGroup'] = pd.cut(df1_copy['age'], bins=age_bins, labels=age_labels, right=False)
-        
-        # Count total users by age group
-        age_group_counts = df1_copy.groupby('AgeGroup').size().reset_index(name='total_users')
-        
-        # Create the plot
-        plt.figure(figsize=(10, 6))
-        bars = plt.bar(age_group_counts['AgeGroup'], age_group_counts['total_users'], 
-                      color='#00008B', edgecolor='black')
-        
-        # Build the title
-        if title_suffix:
-            title = "Total Users by Age Group " + title_suffix
-        else:
-            title = "Total Users by Age Group"
-        title = title.strip()
-        
-        # Customize the plot
-        plt.title(title, fontsize=14, pad=20)
-        plt.xlabel('Age Group (5-year ranges)', fontsize=12)
-        plt.ylabel('Total Users', fontsize=12)
-        plt.grid(axis='y', linestyle='', alpha=0.3)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        
-        # Set up file paths
-        svg_path = 'temp_total_sites_chart.svg'
-        emf_path = 'total_sites_chart.emf'
-        png_path = 'total_sites_chart.png'
-        
-        # Save as SVG first
-        plt.savefig(svg_path, format='svg', bbox_inches='tight', dpi=600, transparent=True)
-        
-        # Try EMF conversion
-        result_path = convert_svg_to_emf(svg_path, emf_path)
-        
-        # Check if EMF conversion succeeded
-        if result_path is None or not os.path.exists(result_path):
-            # Fallback to PNG
-            print("Using PNG fallback for total sites chart...")
-            plt.savefig(png_path, format='png', bbox_inches='tight', dpi=300, transparent=True)
-            plt.close()
-            
-            # Remove temporary SVG
-            if os.path.exists(svg_path):
-                os.remove(svg_path)
-            
-            # Verify PNG was created
-            if os.path.exists(png_path):
-                print("Total sites chart saved as PNG: " , png_path)
-                return png_path
-            else:
-                print("Failed to save PNG total sites chart")
-                return None
-        
-        # EMF conversion successful
-        plt.close()
-        print("Total sites chart saved as EMF: " , result_path)
-        return result_path
+# Titles, series and colours of the native charts, matching the matplotlib ones
+NATIVE_CHART_STYLES = {
+    'total_sites': {
+        'title': "Total Users by Age Group",
+        'column': 'total_users',
+        'y_title': 'Total Users',
+        'color': '00008B',
+        'number_format': '#,##0'
+    },
+    'conversion': {
+        'title': "Average conversion rate vs Age group",
+        'column': 'conversion_rate',
+        'y_title': 'Conversion Rate (%)',
+        'color': '003060',
+        'number_format': '0.00'
+    }
+}
+
+# Function to add a native, editable bar chart straight from the age group series
+def add_native_chart(slide, chart_name, age_group_stats, left, top, width, height):
+    from pptx.chart.data import CategoryChartData
+    from pptx.enum.chart import XL_CHART_TYPE
+    from pptx.dml.color import RGBColor
+    from pptx.util import Pt
     
-    except Exception as e:
-        print("Error generating total sites chart: ",e)
-        plt.close()
+    style = NATIVE_CHART_STYLES[chart_name]
+    chart_data = CategoryChartData(number_format=style['number_format'])
+    chart_data.categories = age_group_stats['AgeGroup'].tolist()
+    # Age groups without users have no value, same as the gaps in the matplotlib chart
+    values = [None if pd.isna(value) else float(value) for value in age_group_stats[style['column']]]
+    chart_data.add_series(style['title'], values)
+    
+    graphic_frame = slide.shapes.add_chart(XL_CHART_TYPE.COLUMN_CLUSTERED, left, top, width, height, chart_data)
+    chart = graphic_frame.chart
+    chart.has_legend = False
+    chart.has_title = True
+    chart.chart_title.text_frame.text = style['title']
+    chart.chart_title.text_frame.paragraphs[0].font.size = Pt(14)
+    
+    # Bar colours with a black outline
+    series = chart.plots[0].series[0]
+    series.format.fill.solid()
+    series.format.fill.fore_color.rgb = RGBColor.from_string(style['color'])
+    series.format.line.color.rgb = RGBColor(0, 0, 0)
+    
+    # Axis titles, no gridlines
+    category_axis = chart.category_axis
+    category_axis.has_title = True
+    category_axis.axis_title.text_frame.text = 'Age Group (5-year ranges)'
+    category_axis.tick_labels.font.size = Pt(10)
+    value_axis = chart.value_axis
+    value_axis.has_title = True
+    value_axis.axis_title.text_frame.text = style['y_title']
+    value_axis.has_major_gridlines = False
+    value_axis.tick_labels.font.size = Pt(10)
+    return graphic_frame
+
+# Function to get what each chart is drawn from: the age group series for native
+# charts, or rendered image buffers for the matplotlib backend (None = no data)
+def get_report_chart_sources(cube_filtered, chart_names, vector=False, age_group_stats=None):
+    if age_group_stats is None:
+        age_group_stats = get_age_group_stats(as_age_cube(cube_filtered))
+    
+    if CHART_BACKEND == 'native':
+        if age_group_stats.empty:
+            logger.warning("DataFrame is empty, cannot generate charts")
+            return [None for _ in chart_names]
+        return [age_group_stats for _ in chart_names]
+    
+    chart_buffers = render_report_charts(cube_filtered, chart_names, title_suffix="", vector=vector,
+                                         age_group_stats=age_group_stats)
+    return [chart_buffers[chart_name] for chart_name in chart_names]
+
+# Function to put a chart on a slide from its source (series or image buffer)
+def add_chart_to_slide(slide, chart_name, chart_source, left, top, width, height):
+    if isinstance(chart_source, pd.DataFrame):
+        try:
+            with timed_span('chart_render', chart=chart_name):
+                return add_native_chart(slide, chart_name, chart_source, left, top, width, height)
+        except Exception as e:
+            # Fall back to a rendered image if the native chart could not be built
+            logger.warning("Native chart failed, using matplotlib instead: %s", e)
+            with timed_span('chart_render', chart=chart_name):
+                chart_source = io.BytesIO(render_chart(chart_name, chart_source, "", 'png'))
+    return slide.shapes.add_picture(chart_source, left, top, width, height)
+
+# What each placeholder token in a template is replaced with: KPI text boxes get
+# the formatted value, chart placeholders mark where a chart goes
+TEMPLATE_BINDINGS = {
+    'A': {'kpi': 'new_users', 'format': "Total new users: {}"},
+    'B': {'kpi': 'converted', 'format': "Total converted:{}"},
+    'C': {'kpi': 'conversion_rate', 'format': "Conversion rate:{}%"},
+    'D': {'chart': 'total_sites'},
+    'E': {'chart': 'conversion'}
+}
+
+# Chart placeholders at least this tall (inches) are frames the chart fills;
+# smaller ones are captions and the chart goes right underneath at CHART_SIZE
+MIN_CHART_FRAME_HEIGHT = 1.5
+CHART_SIZE = (6, 4)
+
+# Where a chart goes (inches, on the slide_index slide) when the template has no
+# placeholder for it
+FALLBACK_CHART_POSITIONS = {
+    'total_sites': (0.5, 3.0),
+    'conversion': (7, 3.0)
+}
+
+# Function to index every bindable placeholder of a template in one pass
+# The index is cached with the parsed template and reused for all its copies
+def index_template_placeholders(prs):
+    placeholders = []
+    for slide_index, slide in enumerate(prs.slides):
+        placeholders += index_slide_placeholders(slide, slide_index)
+    return placeholders
+
+# Function to index the bindable placeholders of one slide
+def index_slide_placeholders(slide, slide_index):
+    placeholders = []
+    for shape in slide.shapes:
+        if not shape.has_text_frame:
+            continue
+        token = shape.text_frame.text.strip()
+        if token in TEMPLATE_BINDINGS:
+            placeholders.append({
+                'slide': slide_index,
+                'shape_id': shape.shape_id,
+                'token': token,
+                'left': shape.left,
+                'top': shape.top,
+                'width': shape.width,
+                'height': shape.height
+            })
+    return placeholders
+
+# Function to work out where a chart goes from its placeholder's geometry
+# Returns None when the placeholder has no position of its own
+def get_chart_frame(placeholder):
+    from pptx.util import Inches, Emu
+    
+    if placeholder['left'] is None or placeholder['top'] is None:
         return None
+    if placeholder['height'] and placeholder['height'] >= Inches(MIN_CHART_FRAME_HEIGHT):
+        return placeholder['left'], placeholder['top'], placeholder['width'], placeholder['height']
+    return (placeholder['left'], Emu(placeholder['top'] + (placeholder['height'] or 0)),
+            Inches(CHART_SIZE[0]), Inches(CHART_SIZE[1]))
 
-def add_charts_to_presentation(prs, df_filtered, slide_index=1):
+# KPI values and age group stats can be passed in when they are already known
+# (segmented reports), otherwise they are calculated from cube_filtered
+def add_charts_to_presentation(prs, cube_filtered, slide_index=1, vector=VECTOR_CHARTS, placeholders=None,
+                               kpi_values=None, age_group_stats=None):
+    from pptx.util import Inches
+    
     try:
-        # Check if the slide index is valid
-        if len(prs.slides) <= slide_index:
-            error_msg = "Slide index " + str(slide_index) + " out of range (presentation has " + str(len(prs.slides)) + " slides)"
-            raise ValueError(error_msg)
+        # Templates that did not come from the registry are indexed here
+        if placeholders is None:
+            placeholders = index_template_placeholders(prs)
+        slides = list(prs.slides)
         
         # Calculate the KPI values
-        print("Calculating KPIs...")
-        total_new_users, total_converted, conversion_rate = calculate_kpis(df_filtered)
-        print("KPIs calculated - New Users:", total_new_users, "Converted:", total_converted, "Rate:", conversion_rate, "%")
+        if kpi_values is None:
+            with timed_span('kpi'):
+                total_new_users, total_converted, conversion_rate = calculate_kpis(cube_filtered)
+            kpi_values = {
+                'new_users': total_new_users,
+                'converted': total_converted,
+                'conversion_rate': conversion_rate
+            }
+        logger.debug("KPIs - New Users: %(new_users)s Converted: %(converted)s Rate: %(conversion_rate)s%%", kpi_values)
+        
+        # Charts without a placeholder keep the old fixed positions on slide_index
+        chart_names = [binding['chart'] for binding in TEMPLATE_BINDINGS.values() if 'chart' in binding]
+        bound_charts = set(TEMPLATE_BINDINGS[placeholder['token']].get('chart') for placeholder in placeholders)
+        unbound_charts = [chart_name for chart_name in chart_names if chart_name not in bound_charts]
+        if unbound_charts and len(slides) <= slide_index:
+            error_msg = "Slide index " + str(slide_index) + " out of range (presentation has " + str(len(slides)) + " slides)"
+            raise ValueError(error_msg)
         
-        # Get the slide we want to work with
-        slide = prs.slides[slide_index]
-        print("Working on slide", slide_index)
+        # Generate every chart once, however many placeholders use it
+        chart_sources = dict(zip(chart_names, get_report_chart_sources(cube_filtered, chart_names, vector,
+                                                                       age_group_stats)))
+        for chart_name in chart_names:
+            if chart_sources[chart_name] is None:
+                logger.error("%s chart not generated", chart_name)
+                return None
         
-        # Update KPI placeholders
-        print("Updating KPI placeholder")
+        # Fill the KPI placeholders, every slide's shapes are looked up by id in
+        # a single pass over that slide
+        chart_frames = []
         kpis_updated = False
-        
-        for shape in slide.shapes:
-            if shape.has_text_frame:
-                text = shape.text_frame.text.strip()
-                
-                if text == 'A':
-                    shape.text_frame.text = "Total new users: " + str(total_new_users)
-                    kpis_updated = True
-                    print("Updated placeholder A with:", total_new_users)
-                elif text == 'B':
-                    shape.text_frame.text = "Total converted:" + str(total_converted)  
-                    kpis_updated = True
-                    print("Updated placeholder B with:", total_converted)
-                elif text == 'C':
-                    shape.text_frame.text = "Conversion rate:" + str(conversion_rate) + "%"  
-                    kpis_updated = True
-                    print("Updated placeholder C with:", conversion_rate, "%")
+        with timed_span('placeholder_binding'):
+            placeholders_by_slide = {}
+            for placeholder in placeholders:
+                placeholders_by_slide.setdefault(placeholder['slide'], []).append(placeholder)
+            
+            for bound_slide_index, slide_placeholders in placeholders_by_slide.items():
+                slide = slides[bound_slide_index]
+                shapes_by_id = {shape.shape_id: shape for shape in slide.shapes}
+                for placeholder in slide_placeholders:
+                    shape = shapes_by_id[placeholder['shape_id']]
+                    binding = TEMPLATE_BINDINGS[placeholder['token']]
+                    if 'kpi' in binding:
+                        shape.text_frame.text = binding['format'].format(kpi_values[binding['kpi']])
+                        kpis_updated = True
+                        continue
+                    
+                    # Chart placeholders only mark the spot, their text goes
+                    shape.text_frame.text = ""
+                    frame = get_chart_frame(placeholder)
+                    if frame is None:
+                        left, top = FALLBACK_CHART_POSITIONS[binding['chart']]
+                        frame = (Inches(left), Inches(top), Inches(CHART_SIZE[0]), Inches(CHART_SIZE[1]))
+                    chart_frames.append((slide, binding['chart'], frame))
         
         # Check if we found any KPI placeholders
         if not kpis_updated:
-            print("No KPI placeholders (A, B, C) were found on the input ppt slide - check the input the slide")
+            logger.warning("No KPI placeholders (A, B, C) were found in the input ppt - check the input slides")
         
-        # Generate both charts
-        print("Generating charts.")
-        chart_path = generate_total_sites_chart(df_filtered, title_suffix="")
-        chart_path1 = generate_conversion_chart(df_filtered, title_suffix="")
-
-        # Add the first chart if it was created successfully
-        if chart_path and os.path.exists(chart_path):
-            print("Total sites chart generated at:", chart_path)
-            try:
-                # Set position for first chart (left side)
-                left = Inches(0.5)  
-                top = Inches(3.0)
-                width = Inches(6)   
-                height = Inches(4)
-                
-                # Add the picture to the slide
-                pic = slide.shapes.add_picture(chart_path, left, top, width, height)
-                print("Total sites chart added to slide successfully")
-                
-                # Look for chart title placeholder and update it
-                title_updated = False
-                for shape in slide.shapes:
-                    if shape.has_text_frame and shape.text_frame.text.strip() == 'D':
-                        shape.text_frame.text = ""
-                        title_updated = True
-                        break
-                
-                if not title_updated:
-                    print("Chart title placeholder 'D' not found")
-                
-            except Exception as e:
-                print("Error adding total sites chart to slide:", e)
-                return None
-        else:
-            print("Error: Total sites chart not generated or file not found")
-            return None
-
-        # Add the second chart if it was created successfully
-        if chart_path1 and os.path.exists(chart_path1):
-            print("Conversion chart generated at:", chart_path1)
+        for chart_name in unbound_charts:
+            logger.warning("Chart placeholder for %s not found, using the default position", chart_name)
+            left, top = FALLBACK_CHART_POSITIONS[chart_name]
+            frame = (Inches(left), Inches(top), Inches(CHART_SIZE[0]), Inches(CHART_SIZE[1]))
+            chart_frames.append((slides[slide_index], chart_name, frame))
+        
+        # Add the charts
+        for slide, chart_name, (left, top, width, height) in chart_frames:
             try:
-                # Set position for second chart (right side)
-                left = Inches(7)    
-                top = Inches(3.0)
-                width = Inches(6)   
-                height = Inches(4)
-                
-                print("Adding conversion chart to slide at position: " + str(left.inches) + "in, " + str(top.inches) + "in")
-                
-                # Add the picture to the slide
-                pic = slide.shapes.add_picture(chart_path1, left, top, width, height)
-                print("Conversion chart added to slide successfully")
-                
-                # Look for chart title placeholder and update it
-                title_updated = False
-                for shape in slide.shapes:
-                    if shape.has_text_frame and shape.text_frame.text.strip() == 'E':
-                        shape.text_frame.text = ""
-                        title_updated = True
-                        break
-                
-                if not title_updated:
-                    print("Chart title placeholder 'E' not found")
-                
+                add_chart_to_slide(slide, chart_name, chart_sources[chart_name], left, top, width, height)
+                logger.debug("%s chart added to slide at %sin, %sin", chart_name, left.inches, top.inches)
             except Exception as e:
-                print("Error adding conversion chart to slide:", e)
+                logger.error("Error adding %s chart to slide: %s", chart_name, e)
                 return None
-        else:
-            print("Error: Conversion chart not generated")
-            return None
         
-        print("Charts added successfully")
-        
-        # Clean up all temporary files
-        temp_files = [
-            'temp_conversion_chart.svg', 'conversion_chart.emf', 'conversion_chart.png',
-            'temp_total_sites_chart.svg', 'total_sites_chart.emf', 'total_sites_chart.png'
-        ]
-        
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    print("Removed temporary file:", temp_file)
-                except Exception as e:
-                    print("Warning: Could not remove", temp_file, ":", e)
-        
-        return prs
+        return prs
         
     except Exception as e:
-        print("Critical error in add_charts_to_presentation:", e)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Critical error in add_charts_to_presentation: %s", e)
         return None
 
 
-def filter_dataframe_by_age(df1, selected_age_category):
+def filter_dataframe_by_age(df1, selected_age_category, age_index=None):
     # Check if we should return all data
-    if selected_age_category == 'all' or not selected_age_category:
+    age_ranges = parse_age_categories(selected_age_category)
+    if age_ranges is None:
         return df1
     
-    # Parse the age range string (e.g., "25-29" becomes min=25, max=29)
-    age_range = selected_age_category.split('-')
-    min_age = int(age_range[0])
-    max_age = int(age_range[1])
+    # With a presorted index only the selected rows are touched
+    if age_index is not None:
+        return df1.iloc[select_age_rows(age_index, age_ranges)]
     
-    # Filter the dataframe based on age range
-    filtered_df = df1[(df1['age'] >= min_age) & (df1['age'] <= max_age)]
-    return filtered_df
+    # Otherwise a single lookup-table pass over the age column
+    ages = df1['age'].to_numpy()
+    if len(ages) == 0:
+        return df1
+    lookup = build_age_lookup(age_ranges, int(ages.max()))
+    return df1[lookup[ages]]
 
 
-def create_presentation(df_filtered, template_path="Sales_presentation1.pptx"):
+# Where the age group heading goes on every segment slide without a title placeholder
+SEGMENT_HEADING_TOP = 1.5
+
+# Function to get the KPIs and chart series of every 5-year age segment
+# from one grouped aggregation over the cube
+def get_segment_stats(cube):
+    cube = as_age_cube(cube)
+    cube = cube[cube['count'] > 0]
+    grouped = cube.assign(new_users=cube['count'] * cube['new_user']).groupby((cube['age'] // 5) * 5)[
+        ['count', 'new_users', 'total_pages_visited', 'converted']].sum()
+    
+    segments = []
+    for category in get_age_categories(cube):
+        start = int(category['value'].split('-')[0])
+        # Segments without users get no slide
+        if start not in grouped.index:
+            continue
+        row = grouped.loc[start]
+        total_converted = int(row['converted'])
+        total_pages_visited = int(row['total_pages_visited'])
+        segments.append({
+            'label': category['label'],
+            'kpis': {
+                'new_users': int(row['new_users']),
+                'converted': total_converted,
+                'conversion_rate': get_conversion_rate(total_converted, total_pages_visited)
+            },
+            # Same columns as get_age_group_stats, one age group per segment
+            'age_group_stats': pd.DataFrame({
+                'AgeGroup': [category['label']],
+                'total_users': [int(row['count'])],
+                'total_pages_visited': [total_pages_visited],
+                'converted': [total_converted],
+                'conversion_rate': [total_converted / int(row['count'])]
+            })
+        })
+    return segments
+
+# Function to add one slide per age segment, copied from the template's KPI slide
+# Has to run before that slide is filled, the copies need its placeholder tokens
+# The new slides go right after the KPI slide; returns the placeholder index
+# updated for the new slide order
+def add_segment_slides(prs, cube_filtered, placeholders, vector=VECTOR_CHARTS):
+    from pptx.util import Inches
+    
+    layout_index = placeholders[0]['slide'] if placeholders else 1
+    layout_slide = prs.slides[layout_index]
+    
+    segments = get_segment_stats(cube_filtered)
+    for segment in segments:
+        slide = prs.slides.add_slide(layout_slide.slide_layout)
+        clone_shapes(layout_slide, slide)
+        slide_index = len(prs.slides) - 1
+        
+        heading = "Age group " + segment['label']
+        if slide.shapes.title is not None:
+            slide.shapes.title.text = heading
+        else:
+            add_heading_text(slide, int(prs.slide_width / 2), Inches(SEGMENT_HEADING_TOP), heading)
+        
+        # Without its KPI tokens the copy would be saved with empty KPI cards
+        slide_placeholders = index_slide_placeholders(slide, slide_index)
+        if not any('kpi' in TEMPLATE_BINDINGS[placeholder['token']] for placeholder in slide_placeholders):
+            raise ValueError("No KPI placeholders were copied to the slide for age group " + segment['label'])
+        
+        filled = add_charts_to_presentation(prs, None, slide_index=slide_index, vector=vector,
+                                            placeholders=slide_placeholders,
+                                            kpi_values=segment['kpis'],
+                                            age_group_stats=segment['age_group_stats'])
+        if filled is None:
+            raise ValueError("Failed to fill the slide for age group " + segment['label'])
+    
+    # New slides are added at the end of the deck, move them to just after the
+    # summary slide so any closing slides of the template stay last
+    slide_id_list = prs.slides._sldIdLst
+    segment_slide_ids = list(slide_id_list)[len(slide_id_list) - len(segments):]
+    for position, slide_id in enumerate(segment_slide_ids):
+        slide_id_list.remove(slide_id)
+        slide_id_list.insert(layout_index + 1 + position, slide_id)
+    logger.debug("Added %d segment slides", len(segments))
+    
+    # Placeholders on the slides that moved down keep pointing at their slide
+    return [dict(placeholder, slide=placeholder['slide'] + len(segments))
+            if placeholder['slide'] > layout_index else placeholder
+            for placeholder in placeholders]
+
+# Parsed templates, so each template is unzipped and XML-parsed only once
+# Every report works on its own deep copy of the parsed master, the placeholder
+# index is shared because copies keep the master's slide order and shape ids
+template_registry = {}
+template_registry_lock = threading.Lock()
+
+# Function to get a fresh, independently editable copy of a parsed template
+# Returns the copy and the template's placeholder index
+def get_template_copy(registry_key, fingerprint, read_template):
+    from pptx import Presentation
+    
+    with timed_span('template_load'):
+        with template_registry_lock:
+            entry = template_registry.get(registry_key)
+            if entry is None or entry['fingerprint'] != fingerprint:
+                master = Presentation(io.BytesIO(read_template()))
+                # Index a throwaway copy: walking the master's shapes caches parts on
+                # it and later deep copies would no longer save their own edits
+                entry = {
+                    'fingerprint': fingerprint,
+                    'master': master,
+                    'placeholders': index_template_placeholders(copy.deepcopy(master))
+                }
+                template_registry[registry_key] = entry
+        return copy.deepcopy(entry['master']), entry['placeholders']
+
+# Function to get a copy of a template file, parsed again only when the file changes
+def get_template_presentation(template_path):
+    fingerprint = get_file_fingerprint(template_path)
+    if fingerprint == 'missing':
+        raise FileNotFoundError("Template file not found at " + template_path)
+    
+    def read_template():
+        with open(template_path, 'rb') as f:
+            return f.read()
+    return get_template_copy(('path', os.path.abspath(template_path)), fingerprint, read_template)
+
+# Function to get a copy of a template that is already in memory (e.g. batch runs)
+def get_template_presentation_from_data(template_data):
+    fingerprint = hashlib.sha256(template_data).hexdigest()
+    return get_template_copy(('data', fingerprint), fingerprint, lambda: template_data)
+
+# Function to build a report and return the .pptx file contents (None on errors)
+# segmented=True adds a slide per 5-year age group after the summary slide
+def create_presentation_data(cube_filtered, template_path=TEMPLATE_PATH, template_data=None, segmented=False):
     try:
-        # Check if template file exists
-        if not os.path.exists(template_path):
-            error_msg = "Template file not found at " + template_path
-            raise FileNotFoundError(error_msg)
-        
-        # Load the template presentation
-        prs = Presentation(template_path)
+        # Load the template presentation from the registry
+        if template_data is not None:
+            prs, placeholders = get_template_presentation_from_data(template_data)
+        else:
+            prs, placeholders = get_template_presentation(template_path)
         
         # Make sure we have enough slides to work with
         if len(prs.slides) < 2:
@@ -629,488 +1632,1005 @@ def create_presentation(df_filtered, template_path="Sales_presentation1.pptx"):
                 title_slide.placeholders[1].text = "Generated on " + current_time
                 
         except Exception as e:
-            print("Warning: Could not update title slide: " + str(e))
+            logger.warning("Could not update title slide: %s", e)
+        
+        # Copy the KPI slide for every age segment while it still has its tokens
+        if segmented:
+            placeholders = add_segment_slides(prs, cube_filtered, placeholders)
         
-        # Add KPIs and charts to the second slide
-        prs = add_charts_to_presentation(prs, df_filtered, slide_index=1)
+        # Fill the KPI and chart placeholders on every slide
+        prs = add_charts_to_presentation(prs, cube_filtered, slide_index=1, placeholders=placeholders)
         
         # Check if chart addition was successful
         if prs is None:
             raise ValueError("Failed to add charts to presentation")
         
-        # Generate filename with timestamp
-        current_timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        ppt_filename = "sales_report_" + current_timestamp + ".pptx"
-        
-        # Save the presentation
-        prs.save(ppt_filename)
-        print("Presentation saved as: " + ppt_filename)
-        
-        return ppt_filename
+        # Save the presentation into memory, the caller decides where it goes
+        ppt_buffer = io.BytesIO()
+        with timed_span('save'):
+            prs.save(ppt_buffer)
+        return ppt_buffer.getvalue()
         
     except Exception as e:
-        print("Error creating presentation: " + str(e))
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error creating presentation: %s", e)
         return None
 
+# Function to build a report and write it to a file, returns the file name (None on errors)
+# Without output_path the file gets a unique name in the working directory
+def create_presentation(cube_filtered, template_path=TEMPLATE_PATH, template_data=None, output_path=None,
+                        segmented=False):
+    ppt_data = create_presentation_data(cube_filtered, template_path=template_path,
+                                        template_data=template_data, segmented=segmented)
+    if ppt_data is None:
+        return None
+    
+    ppt_filename = output_path or get_unique_report_name()
+    try:
+        with open(ppt_filename, 'wb') as f:
+            f.write(ppt_data)
+    except OSError as e:
+        logger.error("Could not save presentation %s: %s", ppt_filename, e)
+        return None
+    logger.info("Presentation saved as: %s", ppt_filename)
+    return ppt_filename
+
+
+# On-disk LRU cache of rendered reports, keyed by selection + data + template
+# (app_config['report_cache_dir']). Reports not used for REPORT_CACHE_MAX_AGE
+# seconds are removed, then the least recently used ones until the cache fits
+# in REPORT_CACHE_MAX_BYTES.
+REPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+REPORT_CACHE_MAX_AGE = 24 * 3600
+
+# Function to build the cache key for a report
+# data_version is the version of the dataset the report is built from (see
+# get_data_version), not the file on disk, which may have rows not read yet
+def get_report_cache_key(selection, data_version, template_path):
+    key_parts = [get_filter_key(selection), data_version, get_file_fingerprint(template_path)]
+    return hashlib.sha256(json.dumps(key_parts).encode('utf-8')).hexdigest()
+
+# Function to read a cached report, returns None on a miss
+def read_cached_report(cache_key):
+    cache_path = os.path.join(app_config['report_cache_dir'], cache_key + '.pptx')
+    try:
+        with open(cache_path, 'rb') as f:
+            ppt_data = f.read()
+    except OSError:
+        return None
+    
+    # Touch the entry so it becomes the most recently used one
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return ppt_data
+
+# Function to add a report to the cache and evict the least recently used ones
+def store_cached_report(cache_key, ppt_data):
+    os.makedirs(app_config['report_cache_dir'], exist_ok=True)
+    cache_path = os.path.join(app_config['report_cache_dir'], cache_key + '.pptx')
+    
+    # Write next to the final name and rename so readers never see half a file
+    temp_path = cache_path + "." + uuid.uuid4().hex + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(ppt_data)
+    os.replace(temp_path, cache_path)
+    
+    evict_report_files(app_config['report_cache_dir'], REPORT_CACHE_MAX_BYTES, REPORT_CACHE_MAX_AGE)
+
+# Function to remove reports older than max_age seconds (None keeps them), then the
+# oldest ones until the directory fits in max_bytes
+def evict_report_files(directory, max_bytes, max_age=None):
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.pptx'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    oldest_kept = time.time() - max_age if max_age is not None else None
+    total_size = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if total_size <= max_bytes and (oldest_kept is None or mtime >= oldest_kept):
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+# Function to name a downloaded report
+def get_report_filename():
+    return "sales_report_" + datetime.now().strftime('%Y%m%d_%H%M%S') + ".pptx"
+
+# Function to name a report file that no other export can be writing at the same time
+def get_unique_report_name():
+    return "sales_report_" + datetime.now().strftime('%Y%m%d_%H%M%S') + "_" + uuid.uuid4().hex[:8] + ".pptx"
+
+# Optional spool keeping a copy of every report exported from the dashboard
+# (app_config['report_spool_dir'], None keeps none). Copies older than
+# REPORT_SPOOL_MAX_AGE seconds are removed, then the oldest ones until the
+# spool fits in REPORT_SPOOL_MAX_BYTES.
+REPORT_SPOOL_MAX_BYTES = 500 * 1024 * 1024
+REPORT_SPOOL_MAX_AGE = 7 * 24 * 3600
+
+# Function to keep a copy of an exported report in the spool, returns its path
+def spool_report(spool_dir, ppt_data):
+    os.makedirs(spool_dir, exist_ok=True)
+    spool_path = os.path.join(spool_dir, get_unique_report_name())
+    
+    # Write next to the final name and rename so readers never see half a file
+    temp_path = spool_path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(ppt_data)
+    os.replace(temp_path, spool_path)
+    
+    evict_report_files(spool_dir, REPORT_SPOOL_MAX_BYTES, REPORT_SPOOL_MAX_AGE)
+    return spool_path
+
+# Function to spool an exported report when a spool directory is configured
+def spool_exported_report(ppt_data):
+    if app_config['report_spool_dir']:
+        try:
+            spool_report(app_config['report_spool_dir'], ppt_data)
+        except OSError as e:
+            logger.warning("Could not spool report: %s", e)
+
+
+# Background export jobs - reports are built in a process pool so the
+# Dash request thread only submits the job and polls for the result.
+# Jobs live as files named by job id in the jobs folder of the report cache
+# directory (see get_export_jobs_dir), so the poll can
+# land on any server worker: <id>.job is written on submit, the export
+# worker adds <id>.pptx and then <id>.done (or <id>.error when it failed).
+# Files of jobs nobody collected are removed after EXPORT_JOB_TTL seconds.
+EXPORT_WORKERS = 2
+EXPORT_POLL_INTERVAL_MS = 1000
+EXPORT_JOB_TTL = 15 * 60
+export_pool = None
+export_pool_lock = threading.Lock()
+
+# Function to create the export process pool on first use
+def get_export_pool():
+    global export_pool
+    with export_pool_lock:
+        if export_pool is None:
+            export_pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=POOL_CONTEXT)
+        return export_pool
+
+# Function to drop a broken export pool so the next job starts a new one
+# (unless another thread has replaced it already)
+def reset_export_pool(broken_pool):
+    global export_pool
+    with export_pool_lock:
+        if export_pool is broken_pool:
+            export_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+# Function to write a file next to its final name and rename it, so readers never see half a file
+def write_file_atomically(path, data):
+    temp_path = path + "." + uuid.uuid4().hex + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+# Function to get the directory holding the export job files
+def get_export_jobs_dir():
+    return os.path.join(app_config['report_cache_dir'], 'jobs')
+
+# Function to get the path of a job's files without extension (None for ids we did not make)
+def get_export_job_path(job_id):
+    if not isinstance(job_id, str) or len(job_id) != 32 or any(c not in '0123456789abcdef' for c in job_id):
+        return None
+    return os.path.join(get_export_jobs_dir(), job_id)
+
+# Function run inside the worker process to build one report
+# The report and the stage timings recorded in the worker go into the job's files
+def run_export_job(cube_filtered, template_path, job_path):
+    span_recorder.spans = []
+    try:
+        ppt_data = create_presentation_data(cube_filtered, template_path=template_path)
+        if ppt_data is None:
+            raise ValueError("Error generating report. Please check template file and debug output.")
+        write_file_atomically(job_path + '.pptx', ppt_data)
+        job_result = {'filename': get_report_filename(), 'spans': span_recorder.spans}
+        write_file_atomically(job_path + '.done', json.dumps(job_result).encode('utf-8'))
+    finally:
+        span_recorder.spans = None
+
+# Function to record a failed job, including workers that died without a word
+def record_export_job_error(job_path, future):
+    error = future.exception()
+    if error is not None:
+        try:
+            write_file_atomically(job_path + '.error', json.dumps({'error': str(error)}).encode('utf-8'))
+        except OSError as e:
+            logger.warning("Could not record export job error: %s", e)
+
+# Function to remove all files of a job
+def remove_export_job(job_path):
+    for extension in ['.pptx', '.done', '.error', '.job']:
+        try:
+            os.remove(job_path + extension)
+        except OSError:
+            pass
+
+# Function to remove the files of jobs older than EXPORT_JOB_TTL
+def remove_expired_export_jobs():
+    oldest_kept = time.time() - EXPORT_JOB_TTL
+    for entry in os.scandir(get_export_jobs_dir()):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < oldest_kept:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+# Function to count the jobs not collected yet
+def count_export_jobs():
+    try:
+        return sum(1 for name in os.listdir(get_export_jobs_dir()) if name.endswith('.job'))
+    except OSError:
+        return 0
+
+# Function to queue a report and return its job id straight away
+def submit_export_job(cube_filtered, template_path=TEMPLATE_PATH, cache_key=None):
+    os.makedirs(get_export_jobs_dir(), exist_ok=True)
+    remove_expired_export_jobs()
+    
+    job_id = uuid.uuid4().hex
+    job_path = get_export_job_path(job_id)
+    job = {'submitted': time.time(), 'cache_key': cache_key}
+    write_file_atomically(job_path + '.job', json.dumps(job).encode('utf-8'))
+    
+    pool = get_export_pool()
+    try:
+        future = pool.submit(run_export_job, cube_filtered, template_path, os.path.abspath(job_path))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory) and took the pool with it, start a new one
+        logger.warning("Export pool is broken, restarting it")
+        reset_export_pool(pool)
+        future = get_export_pool().submit(run_export_job, cube_filtered, template_path, os.path.abspath(job_path))
+    future.add_done_callback(functools.partial(record_export_job_error, job_path))
+    return job_id
+
+# Function to check a job: returns (status, result or error, seconds running)
+def get_export_job_status(job_id):
+    job_path = get_export_job_path(job_id)
+    if job_path is None:
+        return 'missing', None, 0
+    try:
+        with open(job_path + '.job') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return 'missing', None, 0
+    
+    elapsed = time.time() - job['submitted']
+    if os.path.exists(job_path + '.error'):
+        with open(job_path + '.error') as f:
+            error = json.load(f)['error']
+        remove_export_job(job_path)
+        return 'failed', error, elapsed
+    
+    if not os.path.exists(job_path + '.done'):
+        if elapsed > EXPORT_JOB_TTL:
+            remove_export_job(job_path)
+            return 'failed', "the report took too long to generate", elapsed
+        return 'running', None, elapsed
+    
+    # The job is finished, hand it over once (renaming .done claims it, in case
+    # two polls for the same job arrive together) and forget about it
+    claimed_path = job_path + "." + uuid.uuid4().hex + ".claimed"
+    try:
+        os.rename(job_path + '.done', claimed_path)
+    except OSError:
+        return 'running', None, elapsed
+    with open(claimed_path) as f:
+        result = json.load(f)
+    with open(job_path + '.pptx', 'rb') as f:
+        result['data'] = f.read()
+    os.remove(claimed_path)
+    remove_export_job(job_path)
+    result['cache_key'] = job['cache_key']
+    return 'finished', result, elapsed
+
+# Function to build the styled status box shown under the dashboard
+def make_status_message(text, color, background_color, border_color):
+    return html.Div(text, 
+           style={
+               'color': color, 
+               'fontWeight': 'bold',
+               'backgroundColor': background_color,
+               'border': '1px solid ' + border_color,
+               'padding': '12px 20px',
+               'borderRadius': '8px',
+               'display': 'inline-block'
+           })
+
 
 # Create the Dash layout with professional styling
-app.layout = html.Div([
-    # Header Section
-    html.Div([
-        html.H1("Sales Department Dashboard", 
-                style={
-                    'color': '#0051a6', 
-                    'textAlign': 'center', 
-                    'marginBottom': '0px',
-                    'fontSize': '2.5rem',
-                    'fontWeight': '700',
-                    'letterSpacing': '1px'
-                }),
-        html.Hr(style={
-            'border': 'none',
-            'height': '3px',
-            'background': 'linear-gradient(90deg, #0051a6, #007bff)',
-            'margin': '20px auto',
-            'width': '300px',
-            'borderRadius': '2px'
-        })
-    ], style={
-        'backgroundColor': 'white',
-        'padding': '40px 20px 30px 20px',
-        'boxShadow': '0 2px 10px rgba(0,0,0,0.1)',
-        'marginBottom': '40px'
-    }),
+# Function to build the age dropdown options from the data
+def get_age_dropdown_options():
+    options = [{'label': 'All Age Groups', 'value': 'all'}]
+    # Dash also calls the layout once, outside any request, to validate it when
+    # it is assigned - that call must not load the data
+    if flask.has_request_context():
+        options = options + get_age_categories(get_age_cube())
+    return options
+
+# Function to pack the age aggregate and the figure templates for the browser
+# (only in client side filtering mode, and never while Dash validates the layout)
+def get_client_dashboard_data():
+    if not app_config['client_side_filtering'] or not flask.has_request_context():
+        return None
     
-    # Main Content Container
-    html.Div([
-        # Control Panel Section
+    cube = get_age_cube()
+    sites_figure, conversion_figure = build_dashboard_figures(get_age_group_stats(cube))
+    empty_sites_figure, empty_conversion_figure = build_dashboard_figures(get_age_group_stats(cube.iloc[0:0]))
+    return {
+        'cube': {column: cube[column].tolist() for column in CUBE_COLUMNS},
+        'figures': {
+            'sites': sites_figure,
+            'conversion': conversion_figure,
+            'empty_sites': empty_sites_figure,
+            'empty_conversion': empty_conversion_figure
+        }
+    }
+
+# Function to build the layout, called by Dash when the page is served
+# so the data is only loaded once somebody opens the dashboard
+def build_layout():
+    figure_templates = build_figure_templates()
+    return html.Div([
+        # Header Section
         html.Div([
-            html.H3("Dashboard Controls", 
-                   style={
-                       'color': '#0051a6', 
-                       'marginBottom': '25px',
-                       'fontSize': '1.4rem',
-                       'fontWeight': '600'
-                   }),
-            
+            html.H1("Sales Department Dashboard", 
+                    style={
+                        'color': '#0051a6', 
+                        'textAlign': 'center', 
+                        'marginBottom': '0px',
+                        'fontSize': '2.5rem',
+                        'fontWeight': '700',
+                        'letterSpacing': '1px'
+                    }),
+            html.Hr(style={
+                'border': 'none',
+                'height': '3px',
+                'background': 'linear-gradient(90deg, #0051a6, #007bff)',
+                'margin': '20px auto',
+                'width': '300px',
+                'borderRadius': '2px'
+            })
+        ], style={
+            'backgroundColor': 'white',
+            'padding': '40px 20px 30px 20px',
+            'boxShadow': '0 2px 10px rgba(0,0,0,0.1)',
+            'marginBottom': '40px'
+        }),
+    
+        # Main Content Container
+        html.Div([
+            # Control Panel Section
             html.Div([
-                # Age Category Filter Section
+                html.H3("Dashboard Controls", 
+                       style={
+                           'color': '#0051a6', 
+                           'marginBottom': '25px',
+                           'fontSize': '1.4rem',
+                           'fontWeight': '600'
+                       }),
+            
                 html.Div([
-                    html.Label("Select Age Category:", 
-                              style={
-                                  'fontWeight': '600', 
-                                  'marginBottom': '12px', 
-                                  'color': '#333',
-                                  'fontSize': '1rem',
-                                  'display': 'block'
-                              }),
-                    dcc.Dropdown(
-                        id='age-category-dropdown',
-                        options=[{'label': 'All Age Groups', 'value': 'all'}] + get_age_categories(df1),
-                        value='all',
-                        multi=True,
-                        placeholder="Choose age categories...",
-                        style={
-                            'width': '350px', 
-                            'marginBottom': '10px',
-                            'fontSize': '0.95rem'
-                        }
-                    ),
-                    html.Small("Select multiple categories to compare different age groups", 
-                             style={
-                                 'color': '#666', 
-                                 'fontStyle': 'italic',
-                                 'fontSize': '0.85rem'
-                             })
-                ], style={
-                    'display': 'inline-block', 
-                    'marginRight': '80px', 
-                    'verticalAlign': 'top',
-                    'minWidth': '350px'
-                }),
+                    # Age Category Filter Section
+                    html.Div([
+                        html.Label("Select Age Category:", 
+                                  style={
+                                      'fontWeight': '600', 
+                                      'marginBottom': '12px', 
+                                      'color': '#333',
+                                      'fontSize': '1rem',
+                                      'display': 'block'
+                                  }),
+                        dcc.Dropdown(
+                            id='age-category-dropdown',
+                            options=get_age_dropdown_options(),
+                            value='all',
+                            multi=True,
+                            placeholder="Choose age categories...",
+                            style={
+                                'width': '350px', 
+                                'marginBottom': '10px',
+                                'fontSize': '0.95rem'
+                            }
+                        ),
+                        html.Small("Select multiple categories to compare different age groups", 
+                                 style={
+                                     'color': '#666', 
+                                     'fontStyle': 'italic',
+                                     'fontSize': '0.85rem'
+                                 })
+                    ], style={
+                        'display': 'inline-block', 
+                        'marginRight': '80px', 
+                        'verticalAlign': 'top',
+                        'minWidth': '350px'
+                    }),
+                
+                    # User Type and Pages Filter Section
+                    html.Div([
+                        html.Label("Filter Users:", 
+                                  style={
+                                      'fontWeight': '600', 
+                                      'marginBottom': '12px', 
+                                      'color': '#333',
+                                      'fontSize': '1rem',
+                                      'display': 'block'
+                                  }),
+                        dcc.Dropdown(
+                            id='user-type-dropdown',
+                            options=[{'label': 'New users', 'value': 'new'},
+                                     {'label': 'Returning users', 'value': 'returning'}],
+                            value=[],
+                            multi=True,
+                            disabled=not supports_row_filters(),
+                            placeholder="Any user type",
+                            style={
+                                'width': '350px', 
+                                'marginBottom': '10px',
+                                'fontSize': '0.95rem'
+                            }
+                        ),
+                        dcc.Dropdown(
+                            id='pages-dropdown',
+                            options=[{'label': band + " pages visited", 'value': band} for band in PAGE_BANDS],
+                            value=[],
+                            multi=True,
+                            disabled=not supports_row_filters(),
+                            placeholder="Any number of pages visited",
+                            style={
+                                'width': '350px', 
+                                'marginBottom': '10px',
+                                'fontSize': '0.95rem'
+                            }
+                        ),
+                        dcc.RadioItems(
+                            id='filter-match',
+                            options=[{'label': 'Match all filters', 'value': 'and'},
+                                     {'label': 'Match any filter', 'value': 'or'}],
+                            value='and',
+                            inline=True,
+                            inputStyle={'marginRight': '5px'},
+                            labelStyle={'marginRight': '15px', 'fontSize': '0.9rem', 'color': '#333'}
+                        )
+                    ], style={
+                        'display': 'inline-block', 
+                        'verticalAlign': 'top',
+                        'minWidth': '350px'
+                    }),
+                
+                    # Download Section
+                    html.Div([
+                        html.Label("Generate Report:", 
+                                  style={
+                                      'fontWeight': '600', 
+                                      'marginBottom': '12px', 
+                                      'color': '#333',
+                                      'fontSize': '1rem',
+                                      'display': 'block'
+                                  }),
+                        html.Button("📊 Download PowerPoint Report", 
+                                   id="download-btn", 
+                                   n_clicks=0,
+                                   style={
+                                       'backgroundColor': '#0051a6',
+                                       'color': 'white',
+                                       'border': 'none',
+                                       'padding': '12px 24px',
+                                       'fontSize': '1rem',
+                                       'fontWeight': '600',
+                                       'borderRadius': '8px',
+                                       'cursor': 'pointer',
+                                       'transition': 'all 0.3s ease',
+                                       'boxShadow': '0 4px 8px rgba(0,81,166,0.3)',
+                                       'minWidth': '250px'
+                                   }),
+                        dcc.Download(id="download-ppt"),
+                        dcc.Store(id="export-job"),
+                        dcc.Interval(id="export-poll", 
+                                     interval=EXPORT_POLL_INTERVAL_MS, 
+                                     disabled=True),
+                        html.Small("Click to generate and download a comprehensive report", 
+                                 style={
+                                     'color': '#666', 
+                                     'fontStyle': 'italic',
+                                     'fontSize': '0.85rem',
+                                     'display': 'block',
+                                     'marginTop': '8px'
+                                 })
+                    ], style={
+                        'display': 'inline-block', 
+                        'verticalAlign': 'top'
+                    }),
                 
-                # Download Section
-                html.Div([
-                    html.Label("Generate Report:", 
-                              style={
-                                  'fontWeight': '600', 
-                                  'marginBottom': '12px', 
-                                  'color': '#333',
-                                  'fontSize': '1rem',
-                                  'display': 'block'
-                              }),
-                    html.Button("📊 Download PowerPoint Report", 
-                               id="download-btn", 
-                               n_clicks=0,
-                               style={
-                                   'backgroundColor': '#0051a6',
-                                   'color': 'white',
-                                   'border': 'none',
-                                   'padding': '12px 24px',
-                                   'fontSize': '1rem',
-                                   'fontWeight': '600',
-                                   'borderRadius': '8px',
-                                   'cursor': 'pointer',
-                                   'transition': 'all 0.3s ease',
-                                   'boxShadow': '0 4px 8px rgba(0,81,166,0.3)',
-                                   'minWidth': '250px'
-                               }),
-                    dcc.Download(id="download-ppt"),
-                    html.Small("Click to generate and download a comprehensive report", 
-                             style={
-                                 'color': '#666', 
-                                 'fontStyle': 'italic',
-                                 'fontSize': '0.85rem',
-                                 'display': 'block',
-                                 'marginTop': '8px'
-                             })
                 ], style={
-                    'display': 'inline-block', 
-                    'verticalAlign': 'top'
+                    'display': 'flex',
+                    'flexWrap': 'wrap',
+                    'alignItems': 'flex-start',
+                    'gap': '40px'
                 }),
-                
+            
             ], style={
-                'display': 'flex',
-                'flexWrap': 'wrap',
-                'alignItems': 'flex-start',
-                'gap': '40px'
+                'backgroundColor': '#f8f9fa',
+                'padding': '35px',
+                'borderRadius': '15px',
+                'marginBottom': '50px',
+                'boxShadow': '0 4px 12px rgba(0,0,0,0.08)',
+                'border': '1px solid #e9ecef'
             }),
-            
-        ], style={
-            'backgroundColor': '#f8f9fa',
-            'padding': '35px',
-            'borderRadius': '15px',
-            'marginBottom': '50px',
-            'boxShadow': '0 4px 12px rgba(0,0,0,0.08)',
-            'border': '1px solid #e9ecef'
-        }),
         
-        # KPI Cards Section
-        html.Div([
-            html.H3("Key Performance Indicators", 
-                   style={
-                       'color': '#0051a6', 
-                       'textAlign': 'center', 
-                       'marginBottom': '35px',
-                       'fontSize': '1.6rem',
-                       'fontWeight': '600'
-                   }),
-            
+            # KPI Cards Section
             html.Div([
-                # New Users Card
+                html.H3("Key Performance Indicators", 
+                       style={
+                           'color': '#0051a6', 
+                           'textAlign': 'center', 
+                           'marginBottom': '35px',
+                           'fontSize': '1.6rem',
+                           'fontWeight': '600'
+                       }),
+            
                 html.Div([
+                    # New Users Card
                     html.Div([
-                        html.I(className="fas fa-user-plus", style={
-                            'fontSize': '2rem', 
-                            'color': '#28a745',
-                            'marginBottom': '15px'
-                        }),
-                        html.H4("Total New Users", style={
-                            'color': '#333', 
-                            'marginBottom': '12px',
-                            'fontSize': '1.1rem',
-                            'fontWeight': '600'
-                        }),
-                        html.H2(id="kpi-new-users", style={
-                            'color': '#28a745', 
-                            'margin': '0',
-                            'fontSize': '2.2rem',
-                            'fontWeight': '700'
-                        })
-                    ], style={'textAlign': 'center'})
-                ], style={
-                    'backgroundColor': 'white',
-                    'padding': '30px 25px',
-                    'borderRadius': '12px',
-                    'boxShadow': '0 6px 20px rgba(40,167,69,0.15)',
-                    'border': '1px solid #e9ecef',
-                    'minWidth': '220px',
-                    'transition': 'transform 0.3s ease, box-shadow 0.3s ease'
-                }),
+                        html.Div([
+                            html.I(className="fas fa-user-plus", style={
+                                'fontSize': '2rem', 
+                                'color': '#28a745',
+                                'marginBottom': '15px'
+                            }),
+                            html.H4("Total New Users", style={
+                                'color': '#333', 
+                                'marginBottom': '12px',
+                                'fontSize': '1.1rem',
+                                'fontWeight': '600'
+                            }),
+                            html.H2(id="kpi-new-users", style={
+                                'color': '#28a745', 
+                                'margin': '0',
+                                'fontSize': '2.2rem',
+                                'fontWeight': '700'
+                            })
+                        ], style={'textAlign': 'center'})
+                    ], style={
+                        'backgroundColor': 'white',
+                        'padding': '30px 25px',
+                        'borderRadius': '12px',
+                        'boxShadow': '0 6px 20px rgba(40,167,69,0.15)',
+                        'border': '1px solid #e9ecef',
+                        'minWidth': '220px',
+                        'transition': 'transform 0.3s ease, box-shadow 0.3s ease'
+                    }),
                 
-                # Converted Users Card
-                html.Div([
+                    # Converted Users Card
                     html.Div([
-                        html.I(className="fas fa-check-circle", style={
-                            'fontSize': '2rem', 
-                            'color': '#dc3545',
-                            'marginBottom': '15px'
-                        }),
-                        html.H4("Total Converted", style={
-                            'color': '#333', 
-                            'marginBottom': '12px',
-                            'fontSize': '1.1rem',
-                            'fontWeight': '600'
-                        }),
-                        html.H2(id="kpi-converted", style={
-                            'color': '#dc3545', 
-                            'margin': '0',
-                            'fontSize': '2.2rem',
-                            'fontWeight': '700'
-                        })
-                    ], style={'textAlign': 'center'})
-                ], style={
-                    'backgroundColor': 'white',
-                    'padding': '30px 25px',
-                    'borderRadius': '12px',
-                    'boxShadow': '0 6px 20px rgba(220,53,69,0.15)',
-                    'border': '1px solid #e9ecef',
-                    'minWidth': '220px',
-                    'transition': 'transform 0.3s ease, box-shadow 0.3s ease'
-                }),
+                        html.Div([
+                            html.I(className="fas fa-check-circle", style={
+                                'fontSize': '2rem', 
+                                'color': '#dc3545',
+                                'marginBottom': '15px'
+                            }),
+                            html.H4("Total Converted", style={
+                                'color': '#333', 
+                                'marginBottom': '12px',
+                                'fontSize': '1.1rem',
+                                'fontWeight': '600'
+                            }),
+                            html.H2(id="kpi-converted", style={
+                                'color': '#dc3545', 
+                                'margin': '0',
+                                'fontSize': '2.2rem',
+                                'fontWeight': '700'
+                            })
+                        ], style={'textAlign': 'center'})
+                    ], style={
+                        'backgroundColor': 'white',
+                        'padding': '30px 25px',
+                        'borderRadius': '12px',
+                        'boxShadow': '0 6px 20px rgba(220,53,69,0.15)',
+                        'border': '1px solid #e9ecef',
+                        'minWidth': '220px',
+                        'transition': 'transform 0.3s ease, box-shadow 0.3s ease'
+                    }),
                 
-                # Conversion Rate Card
-                html.Div([
+                    # Conversion Rate Card
                     html.Div([
-                        html.I(className="fas fa-percentage", style={
-                            'fontSize': '2rem', 
-                            'color': '#ffc107',
-                            'marginBottom': '15px'
-                        }),
-                        html.H4("Conversion Rate", style={
-                            'color': '#333', 
-                            'marginBottom': '12px',
-                            'fontSize': '1.1rem',
-                            'fontWeight': '600'
-                        }),
-                        html.H2(id="kpi-conversion-rate", style={
-                            'color': '#ffc107', 
-                            'margin': '0',
-                            'fontSize': '2.2rem',
-                            'fontWeight': '700'
-                        })
-                    ], style={'textAlign': 'center'})
-                ], style={
-                    'backgroundColor': 'white',
-                    'padding': '30px 25px',
-                    'borderRadius': '12px',
-                    'boxShadow': '0 6px 20px rgba(255,193,7,0.15)',
-                    'border': '1px solid #e9ecef',
-                    'minWidth': '220px',
-                    'transition': 'transform 0.3s ease, box-shadow 0.3s ease'
-                })
+                        html.Div([
+                            html.I(className="fas fa-percentage", style={
+                                'fontSize': '2rem', 
+                                'color': '#ffc107',
+                                'marginBottom': '15px'
+                            }),
+                            html.H4("Conversion Rate", style={
+                                'color': '#333', 
+                                'marginBottom': '12px',
+                                'fontSize': '1.1rem',
+                                'fontWeight': '600'
+                            }),
+                            html.H2(id="kpi-conversion-rate", style={
+                                'color': '#ffc107', 
+                                'margin': '0',
+                                'fontSize': '2.2rem',
+                                'fontWeight': '700'
+                            })
+                        ], style={'textAlign': 'center'})
+                    ], style={
+                        'backgroundColor': 'white',
+                        'padding': '30px 25px',
+                        'borderRadius': '12px',
+                        'boxShadow': '0 6px 20px rgba(255,193,7,0.15)',
+                        'border': '1px solid #e9ecef',
+                        'minWidth': '220px',
+                        'transition': 'transform 0.3s ease, box-shadow 0.3s ease'
+                    })
                 
-            ], style={
-                'display': 'flex', 
-                'justifyContent': 'center', 
-                'flexWrap': 'wrap', 
-                'gap': '30px'
-            }),
+                ], style={
+                    'display': 'flex', 
+                    'justifyContent': 'center', 
+                    'flexWrap': 'wrap', 
+                    'gap': '30px'
+                }),
             
-        ], style={'marginBottom': '50px'}),
+            ], style={'marginBottom': '50px'}),
         
-        # Update the Analytics Chart Section in your app.layout
-html.Div([
-    html.H3("Analytics Overview", 
-           style={
-               'color': '#0051a6', 
-               'textAlign': 'center', 
-               'marginBottom': '30px',
-               'fontSize': '1.6rem',
-               'fontWeight': '600'
-           }),
+            # Update the Analytics Chart Section in your app.layout
     html.Div([
-        # First Chart - Total Sites Visited
+        html.H3("Analytics Overview", 
+               style={
+                   'color': '#0051a6', 
+                   'textAlign': 'center', 
+                   'marginBottom': '30px',
+                   'fontSize': '1.6rem',
+                   'fontWeight': '600'
+               }),
         html.Div([
-            dcc.Graph(
-                id="age-chart",
-                config={
-                    'displayModeBar': True,
-                    'displaylogo': False,
-                    'modeBarButtonsToRemove': ['pan2d', 'lasso2d', 'select2d']
-                }
-            )
-        ], style={
-            'backgroundColor': 'white',
-            'borderRadius': '12px',
-            'padding': '20px',
-            'marginBottom': '30px',
-            'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'
-        }),
+            # First Chart - Total Sites Visited
+            html.Div([
+                dcc.Graph(
+                    id="age-chart",
+                    figure=figure_templates[0],
+                    config={
+                        'displayModeBar': True,
+                        'displaylogo': False,
+                        'modeBarButtonsToRemove': ['pan2d', 'lasso2d', 'select2d']
+                    }
+                )
+            ], style={
+                'backgroundColor': 'white',
+                'borderRadius': '12px',
+                'padding': '20px',
+                'marginBottom': '30px',
+                'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'
+            }),
         
-        # Second Chart - Conversion Rate
-        html.Div([
-            dcc.Graph(
-                id="conversion-chart",
-                config={
-                    'displayModeBar': True,
-                    'displaylogo': False,
-                    'modeBarButtonsToRemove': ['pan2d', 'lasso2d', 'select2d']
-                }
-            )
-        ], style={
-            'backgroundColor': 'white',
-            'borderRadius': '12px',
-            'padding': '20px',
-            'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'
-        })
-    ])
-        ], style={
-            'backgroundColor': 'white',
-            'padding': '35px',
-            'borderRadius': '15px',
-            'boxShadow': '0 6px 20px rgba(0,0,0,0.1)',
-            'border': '1px solid #e9ecef',
-            'marginBottom': '40px'
-        }),
+            # Second Chart - Conversion Rate
+            html.Div([
+                dcc.Graph(
+                    id="conversion-chart",
+                    figure=figure_templates[1],
+                    config={
+                        'displayModeBar': True,
+                        'displaylogo': False,
+                        'modeBarButtonsToRemove': ['pan2d', 'lasso2d', 'select2d']
+                    }
+                )
+            ], style={
+                'backgroundColor': 'white',
+                'borderRadius': '12px',
+                'padding': '20px',
+                'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'
+            })
+        ])
+            ], style={
+                'backgroundColor': 'white',
+                'padding': '35px',
+                'borderRadius': '15px',
+                'boxShadow': '0 6px 20px rgba(0,0,0,0.1)',
+                'border': '1px solid #e9ecef',
+                'marginBottom': '40px'
+            }),
         
-        # Status Messages Section
-        html.Div(id="status-message", style={
-            'textAlign': 'center',
-            'padding': '20px',
-            'borderRadius': '8px',
-            'marginTop': '20px'
-        })
+            # Polls the sales data for appended rows
+            dcc.Interval(id="live-refresh", 
+                         interval=app_config['live_refresh_ms'] or 60000, 
+                         disabled=not app_config['live_refresh_ms']),
+            dcc.Store(id="age-cube-store", data=get_client_dashboard_data()),
+        
+            # Status Messages Section
+            html.Div(id="status-message", style={
+                'textAlign': 'center',
+                'padding': '20px',
+                'borderRadius': '8px',
+                'marginTop': '20px'
+            })
         
+        ], style={
+            'maxWidth': '1400px', 
+            'margin': '0 auto', 
+            'padding': '0 30px 40px 30px'
+        })
+    
     ], style={
-        'maxWidth': '1400px', 
-        'margin': '0 auto', 
-        'padding': '0 30px 40px 30px'
+        'backgroundColor': '#f5f7fa',
+        'minHeight': '100vh',
+        'fontFamily': '"Segoe UI", Tahoma, Geneva, Verdana, sans-serif'
     })
+
+# Dashboard results by selection key, most recently used last. Every entry is
+# for the data version in dashboard_cache_version; a new version empties it.
+dashboard_cache = collections.OrderedDict()
+dashboard_cache_version = None
+dashboard_cache_stats = {'hits': 0, 'misses': 0}
+dashboard_cache_lock = threading.Lock()
+
+# Connection to the shared dashboard cache database, one per request thread
+dashboard_cache_db = threading.local()
+
+# Function to get this thread's connection to the shared dashboard cache database,
+# opened (and the table created) the first time the thread needs it
+# Rows are keyed by selection and data version: workers that have not picked up
+# the same rows yet can share the file without removing each other's entries
+def get_dashboard_cache_db(cache_path):
+    connection = getattr(dashboard_cache_db, 'connection', None)
+    if connection is not None and dashboard_cache_db.path != cache_path:
+        connection.close()
+        connection = None
+    if connection is None:
+        connection = sqlite3.connect(cache_path, timeout=5)
+        connection.execute("CREATE TABLE IF NOT EXISTS dashboard_results ("
+                           "selection TEXT, version TEXT, result TEXT, used REAL, "
+                           "PRIMARY KEY (selection, version))")
+        dashboard_cache_db.connection = connection
+        dashboard_cache_db.path = cache_path
+    return connection
+
+# Function to look up cached dashboard outputs, returns None on a miss
+def read_dashboard_cache(selection, version):
+    global dashboard_cache_version
+    with dashboard_cache_lock:
+        if dashboard_cache_version != version:
+            dashboard_cache.clear()
+            dashboard_cache_version = version
+        result = dashboard_cache.get(selection)
+        if result is not None:
+            dashboard_cache.move_to_end(selection)
+            dashboard_cache_stats['hits'] += 1
+            return result
     
-], style={
-    'backgroundColor': '#f5f7fa',
-    'minHeight': '100vh',
-    'fontFamily': '"Segoe UI", Tahoma, Geneva, Verdana, sans-serif'
-})
+    # Another worker may already have computed it
+    cache_path = app_config['dashboard_cache_path']
+    if cache_path:
+        try:
+            with get_dashboard_cache_db(cache_path) as connection:
+                row = connection.execute("SELECT result FROM dashboard_results WHERE selection = ? AND version = ?",
+                                         (selection, version)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE dashboard_results SET used = ? WHERE selection = ? AND version = ?",
+                                       (time.time(), selection, version))
+                    result = tuple(json.loads(row[0]))
+        except sqlite3.Error as e:
+            logger.warning("Could not read dashboard cache: %s", e)
+    
+    with dashboard_cache_lock:
+        if result is None:
+            dashboard_cache_stats['misses'] += 1
+        else:
+            dashboard_cache_stats['hits'] += 1
+            remember_dashboard_result(selection, version, result)
+    return result
+
+# Function to keep dashboard outputs in the in-process LRU (lock must be held)
+def remember_dashboard_result(selection, version, result):
+    if dashboard_cache_version != version:
+        return
+    dashboard_cache[selection] = result
+    dashboard_cache.move_to_end(selection)
+    while len(dashboard_cache) > app_config['dashboard_cache_size']:
+        dashboard_cache.popitem(last=False)
+
+# Function to store freshly computed dashboard outputs
+def store_dashboard_cache(selection, version, result):
+    with dashboard_cache_lock:
+        remember_dashboard_result(selection, version, result)
+    
+    cache_path = app_config['dashboard_cache_path']
+    if cache_path:
+        try:
+            with get_dashboard_cache_db(cache_path) as connection:
+                connection.execute("INSERT OR REPLACE INTO dashboard_results VALUES (?, ?, ?, ?)",
+                                   (selection, version, json.dumps(result), time.time()))
+                # Entries for older data stop being used and are the first to go
+                connection.execute("DELETE FROM dashboard_results WHERE rowid NOT IN ("
+                                   "SELECT rowid FROM dashboard_results ORDER BY used DESC LIMIT ?)",
+                                   (app_config['dashboard_cache_size'],))
+        except sqlite3.Error as e:
+            logger.warning("Could not write dashboard cache: %s", e)
+
+# Function to get the dashboard cache hit and miss counters
+def get_dashboard_cache_stats():
+    with dashboard_cache_lock:
+        stats = dict(dashboard_cache_stats)
+        stats['entries'] = len(dashboard_cache)
+    return stats
+
+# Callback for the dashboard: filter changes and live refresh ticks
+def refresh_dashboard(selected_age_categories, user_types, page_bands, match, n_intervals):
+    data_changed = refresh_dataset()
+    # Nothing new in the CSV, leave the dashboard as it is
+    if dash.ctx.triggered_id == 'live-refresh' and not data_changed:
+        return (no_update,) * 5
+    return update_dashboard(selected_age_categories, user_types, page_bands, match)
+
+# Function to answer the dashboard from the result cache, computing it on a miss
+@timed_callback
+def update_dashboard(selected_age_categories, user_types=None, page_bands=None, match='and'):
+    filters = {'age': selected_age_categories, 'user_type': user_types, 'pages': page_bands, 'match': match}
+    selection = get_filter_key(filters)
+    data = get_dataset()
+    # Take the cube and its version together so a refresh cannot slip in between
+    with dataset_lock:
+        cube, version = data['cube'], data['version']
+    
+    result = read_dashboard_cache(selection, version)
+    if result is None:
+        result = compute_dashboard(cube, filters)
+        store_dashboard_cache(selection, version, result)
+    
+    # The KPI texts in full, the charts as patches on the figures already on the page
+    total_new_users, total_converted, conversion_rate, sites_bars, conversion_bars = result
+    return (
+        total_new_users,
+        total_converted,
+        conversion_rate,
+        build_figure_patch(sites_bars, DASHBOARD_CHART_TITLES['sites']),
+        build_figure_patch(conversion_bars, DASHBOARD_CHART_TITLES['conversion'])
+    )
 
 # Updated callback with improved chart formatting
-@app.callback(
-    [Output('kpi-new-users', 'children'),
-     Output('kpi-converted', 'children'),
-     Output('kpi-conversion-rate', 'children'),
-     Output('age-chart', 'figure'),
-     Output('conversion-chart', 'figure')],
-    [Input('age-category-dropdown', 'value')]
-)
-def update_dashboard(selected_age_categories):
-    # Filter the dataframe based on selected age categories
-    if 'all' in selected_age_categories or not selected_age_categories:
-        df_filtered = df1
-    else:
-        # Handle multiple age category selections
-        age_ranges = []
-        for category in selected_age_categories:
-            age_parts = category.split('-')
-            min_age = int(age_parts[0])
-            max_age = int(age_parts[1])
-            age_ranges.append((min_age, max_age))
-        
-        # Create filter condition for all selected age ranges
-        conditions = []
-        for min_age, max_age in age_ranges:
-            condition = (df1['age'] >= min_age) & (df1['age'] <= max_age)
-            conditions.append(condition)
-        
-        # Combine conditions with OR logic
-        if conditions:
-            combined_condition = conditions[0]
-            for condition in conditions[1:]:
-                combined_condition = combined_condition | condition
-            df_filtered = df1[combined_condition]
-        else:
-            df_filtered = df1
+def compute_dashboard(cube, selection):
+    # Filter the aggregate cube based on the selected filters
+    with timed_span('filter'):
+        cube_filtered = get_filtered_cube(cube, selection)
     
     # Calculate KPIs using the filtered data
-    total_new_users, total_converted, conversion_rate = calculate_kpis(df_filtered)
+    with timed_span('kpi'):
+        total_new_users, total_converted, conversion_rate = calculate_kpis(cube_filtered)
     
-    # Create both chart figures
-    if not df_filtered.empty:
-        # Create age bins for the charts
-        min_age = (min(df_filtered['age']) // 5) * 5
-        max_age = (max(df_filtered['age']) // 5) * 5
-        age_bins = range(min_age, max_age + 6, 5)
-        
-        # Build age labels manually
-        age_labels = []
-        for i in age_bins[:-1]:
-            label = str(i) + "-" + str(i + 4)
-            age_labels.append(label)
-        
-        # Work with a copy of the filtered dataframe
-        df_filtered_copy = df_filtered.copy()
-        df_filtered_copy['AgeGroup'] = pd.cut(df_filtered_copy['age'], bins=age_bins, labels=age_labels, right=False)
-        
-        # First chart - Total Sites Visited
-        age_group_stats = df_filtered_copy.groupby('AgeGroup')['total_pages_visited'].sum().reset_index()
-        sites_figure = {
-            'data': [{
-                'x': age_group_stats['AgeGroup'].astype(str),
-                'y': age_group_stats['total_pages_visited'],
-                'type': 'bar',
-                'marker': {
-                    'color': '#0051a6',
-                    'line': {'color': '#003d82', 'width': 1}
-                },
-                'hovertemplate': '<b>Age Group:</b> %{x}<br><b>Total Sites Visited:</b> %{y:,}<extra></extra>'
-            }],
-            'layout': {
-                'title': {
-                    'text': 'Total Sites Visited by Age Group',
-                    'x': 0.5,
-                    'font': {'size': 18, 'color': '#0051a6', 'family': 'Segoe UI'}
-                },
-                'xaxis': {
-                    'title': {'text': 'Age Group', 'font': {'size': 14, 'color': '#333'}},
-                    'tickfont': {'size': 12, 'color': '#666'},
-                    'gridcolor': '#e9ecef'
-                },
-                'yaxis': {
-                    'title': {'text': 'Total Sites Visited', 'font': {'size': 14, 'color': '#333'}},
-                    'tickfont': {'size': 12, 'color': '#666'},
-                    'gridcolor': '#e9ecef'
-                },
-                'plot_bgcolor': 'white',
-                'paper_bgcolor': 'white',
-                'font': {'family': 'Segoe UI'},
-                'margin': {'l': 80, 'r': 40, 't': 80, 'b': 80},
-                'hovermode': 'x'
-            }
+    # Age group totals for both charts, only the bars are sent to the browser
+    age_group_stats = get_age_group_stats(cube_filtered)
+    sites_bars, conversion_bars = get_dashboard_bars(age_group_stats)
+    
+    # Return the formatted KPI values and chart figures
+    total_users_formatted = str(total_new_users) + ","
+    total_users_formatted = "{:,}".format(total_new_users)
+    
+    total_converted_formatted = "{:,}".format(total_converted)
+    
+    conversion_rate_formatted = str(conversion_rate) + "%"
+    
+    return (
+        total_users_formatted, 
+        total_converted_formatted, 
+        conversion_rate_formatted, 
+        sites_bars, 
+        conversion_bars
+    )
+
+# Title shown instead of the chart title when the filters match no rows
+NO_DATA_TITLE = 'No data available for selected filter'
+
+# Titles of the two dashboard charts
+DASHBOARD_CHART_TITLES = {
+    'sites': 'Total Sites Visited by Age Group',
+    'conversion': 'Conversion Rate by Age Group'
+}
+
+# Function to build the static part of both dashboard charts: layout, fonts,
+# colours and hover text, with no bars yet. It is sent once with the page,
+# after that the dashboard callback only patches in the bars
+def build_figure_templates():
+    # First chart - Total Sites Visited
+    sites_figure = {
+        'data': [{
+            'x': [],
+            'y': [],
+            'type': 'bar',
+            'marker': {
+                'color': '#0051a6',
+                'line': {'color': '#003d82', 'width': 1}
+            },
+            'hovertemplate': '<b>Age Group:</b> %{x}<br><b>Total Sites Visited:</b> %{y:,}<extra></extra>'
+        }],
+        'layout': {
+            'title': {
+                'text': DASHBOARD_CHART_TITLES['sites'],
+                'x': 0.5,
+                'font': {'size': 18, 'color': '#0051a6', 'family': 'Segoe UI'}
+            },
+            'xaxis': {
+                'title': {'text': 'Age Group', 'font': {'size': 14, 'color': '#333'}},
+                'tickfont': {'size': 12, 'color': '#666'},
+                'gridcolor': '#e9ecef'
+            },
+            'yaxis': {
+                'title': {'text': 'Total Sites Visited', 'font': {'size': 14, 'color': '#333'}},
+                'tickfont': {'size': 12, 'color': '#666'},
+                'gridcolor': '#e9ecef'
+            },
+            'plot_bgcolor': 'white',
+            'paper_bgcolor': 'white',
+            'font': {'family': 'Segoe UI'},
+            'margin': {'l': 80, 'r': 40, 't': 80, 'b': 80},
+            'hovermode': 'x'
         }
-        # Second chart - Conversion Rate
-        conversion_stats = df_filtered_copy.groupby('AgeGroup')['converted'].mean().reset_index()
-        conversion_figure = {
-            'data': [{
-                'x': conversion_stats['AgeGroup'].astype(str),
-                'y': conversion_stats['converted'] * 100,  
-                'type': 'bar',
-                'marker': {
-                    'color': '#28a745',
-                    'line': {'color': '#218838', 'width': 1}
-                },
-                'hovertemplate': '<b>Age Group:</b> %{x}<br><b>Conversion Rate:</b> %{y:.1f}%<extra></extra>'
-            }],
-            'layout': {
-                'title': {
-                    'text': 'Conversion Rate by Age Group',
-                    'x': 0.5,
-                    'font': {'size': 18, 'color': '#0051a6', 'family': 'Segoe UI'}
-                },
-                'xaxis': {
-                    'title': {'text': 'Age Group', 'font': {'size': 14, 'color': '#333'}},
-                    'tickfont': {'size': 12, 'color': '#666'},
-                    'gridcolor': '#e9ecef'
-                },
-                'yaxis': {
-                    'title': {'text': 'Conversion Rate (%)', 'font': {'size': 14, 'color': '#333'}},
-                    'tickfont': {'size': 12, 'color': '#666'},
-                    'gridcolor': '#e9ecef',
-                    'ticksuffix': '%'
-                },
-                'plot_bgcolor': 'white',
-                'paper_bgcolor': 'white',
-                'font': {'family': 'Segoe UI'},
-                'margin': {'l': 80, 'r': 40, 't': 80, 'b': 80},
-                'hovermode': 'x'
-            }
+    }
+    # Second chart - Conversion Rate
+    conversion_figure = {
+        'data': [{
+            'x': [],
+            'y': [],
+            'type': 'bar',
+            'marker': {
+                'color': '#28a745',
+                'line': {'color': '#218838', 'width': 1}
+            },
+            'hovertemplate': '<b>Age Group:</b> %{x}<br><b>Conversion Rate:</b> %{y:.1f}%<extra></extra>'
+        }],
+        'layout': {
+            'title': {
+                'text': DASHBOARD_CHART_TITLES['conversion'],
+                'x': 0.5,
+                'font': {'size': 18, 'color': '#0051a6', 'family': 'Segoe UI'}
+            },
+            'xaxis': {
+                'title': {'text': 'Age Group', 'font': {'size': 14, 'color': '#333'}},
+                'tickfont': {'size': 12, 'color': '#666'},
+                'gridcolor': '#e9ecef'
+            },
+            'yaxis': {
+                'title': {'text': 'Conversion Rate (%)', 'font': {'size': 14, 'color': '#333'}},
+                'tickfont': {'size': 12, 'color': '#666'},
+                'gridcolor': '#e9ecef',
+                'ticksuffix': '%'
+            },
+            'plot_bgcolor': 'white',
+            'paper_bgcolor': 'white',
+            'font': {'family': 'Segoe UI'},
+            'margin': {'l': 80, 'r': 40, 't': 80, 'b': 80},
+            'hovermode': 'x'
         }
+    }
+    return sites_figure, conversion_figure
+
+# Function to get the bars of both charts from the age group totals
+def get_dashboard_bars(age_group_stats):
+    if age_group_stats.empty:
+        return {'x': [], 'y': []}, {'x': [], 'y': []}
+    age_groups = age_group_stats['AgeGroup'].tolist()
+    sites_bars = {'x': age_groups, 'y': age_group_stats['total_pages_visited'].tolist()}
+    conversion_bars = {'x': age_groups, 'y': (age_group_stats['conversion_rate'] * 100).tolist()}
+    return sites_bars, conversion_bars
+
+# Function to build both complete dashboard chart figures from the age group totals
+def build_dashboard_figures(age_group_stats):
+    # Create both chart figures
+    if not age_group_stats.empty:
+        sites_figure, conversion_figure = build_figure_templates()
+        sites_bars, conversion_bars = get_dashboard_bars(age_group_stats)
+        sites_figure['data'][0].update(sites_bars)
+        conversion_figure['data'][0].update(conversion_bars)
     else:
         # Empty figures if no data available
         empty_layout = {
             'title': {
-                'text': 'No data available for selected filter',
+                'text': NO_DATA_TITLE,
                 'x': 0.5,
                 'font': {'size': 18, 'color': '#666', 'family': 'Segoe UI'}
             },
@@ -1125,122 +2645,339 @@ def update_dashboard(selected_age_categories):
         conversion_figure = {'data': [], 'layout': empty_layout.copy()}
         conversion_figure['layout']['yaxis']['title']['text'] = 'Conversion Rate (%)'
     
-    # Return the formatted KPI values and chart figures
-    total_users_formatted = str(total_new_users) + ","
-    total_users_formatted = "{:,}".format(total_new_users)
-    
-    total_converted_formatted = "{:,}".format(total_converted)
-    
-    conversion_rate_formatted = str(conversion_rate) + "%"
-    
-    return (
-        total_users_formatted, 
-        total_converted_formatted, 
-        conversion_rate_formatted, 
-        sites_figure, 
-        conversion_figure
-    )
+    return sites_figure, conversion_figure
+
+# Function to build the partial update for one chart: only the bars and the
+# title change between selections, the rest of the figure stays in the browser
+def build_figure_patch(bars, title):
+    patch = dash.Patch()
+    patch['data'][0]['x'] = bars['x']
+    patch['data'][0]['y'] = bars['y']
+    patch['layout']['title']['text'] = title if bars['x'] else NO_DATA_TITLE
+    return patch
 
-# Callback for PowerPoint download 
-@app.callback(
-    [Output("download-ppt", "data"),
-     Output("status-message", "children")],
-    [Input("download-btn", "n_clicks")],
-    [State('age-category-dropdown', 'value')],
-    prevent_initial_call=True
-)
-def download_ppt(n_clicks, selected_age_categories):
+# Callback for PowerPoint download - only queues the export job
+@timed_callback
+def download_ppt(n_clicks, selected_age_categories, user_types=None, page_bands=None, match='and'):
     if n_clicks > 0:
         try:
-            # Filter the dataframe based on selected categories
-            if 'all' in selected_age_categories or not selected_age_categories:
-                df_filtered = df1
-            else:
-                # Handle multiple age category selections
-                age_ranges = []
-                for category in selected_age_categories:
-                    age_parts = category.split('-')
-                    min_age = int(age_parts[0])
-                    max_age = int(age_parts[1])
-                    age_ranges.append((min_age, max_age))
-                
-                # Create filter condition for all selected age ranges
-                conditions = []
-                for min_age, max_age in age_ranges:
-                    condition = (df1['age'] >= min_age) & (df1['age'] <= max_age)
-                    conditions.append(condition)
-                
-                # Combine conditions with OR logic
-                if conditions:
-                    combined_condition = conditions[0]
-                    for condition in conditions[1:]:
-                        combined_condition = combined_condition | condition
-                    df_filtered = df1[combined_condition]
-                else:
-                    df_filtered = df1
-            
-            # Create presentation using template
-            ppt_filename = create_presentation(df_filtered, template_path="Sales_presentation1.pptx")
+            filters = {'age': selected_age_categories, 'user_type': user_types, 'pages': page_bands, 'match': match}
+            data = get_dataset()
+            # Take the cube and its version together so a refresh cannot slip in between
+            with dataset_lock:
+                cube, version = data['cube'], data['version']
             
-            # Check if presentation was created successfully
-            if ppt_filename and os.path.exists(ppt_filename):
-                # Read the file and prepare for download
-                with open(ppt_filename, 'rb') as f:
-                    ppt_data = f.read()
-                
-                # Return success response
-                success_message = html.Div("✅ Report downloaded successfully!", 
-                       style={
-                           'color': '#28a745', 
-                           'fontWeight': 'bold',
-                           'backgroundColor': '#d4edda',
-                           'border': '1px solid #c3e6cb',
-                           'padding': '12px 20px',
-                           'borderRadius': '8px',
-                           'display': 'inline-block'
-                       })
-                
+            # Serve the report straight from the cache when it was built before
+            cache_key = get_report_cache_key(filters, version, app_config['template_path'])
+            ppt_data = read_cached_report(cache_key)
+            if ppt_data is not None:
+                spool_exported_report(ppt_data)
+                success_message = make_status_message("✅ Report downloaded successfully!", 
+                                                      '#28a745', '#d4edda', '#c3e6cb')
                 return (
-                    dcc.send_bytes(ppt_data, filename=ppt_filename),
-                    success_message
+                    no_update,
+                    True,
+                    success_message,
+                    dcc.send_bytes(ppt_data, filename=get_report_filename())
                 )
-            else:
-                # Return error if presentation creation failed
-                error_message = html.Div("Error generating report. Please check template file and debug output.", 
-                       style={
-                           'color': '#dc3545', 
-                           'fontWeight': 'bold',
-                           'backgroundColor': '#f8d7da',
-                           'border': '1px solid #f5c6cb',
-                           'padding': '12px 20px',
-                           'borderRadius': '8px',
-                           'display': 'inline-block'
-                       })
-                
-                return (no_update, error_message)
+            
+            # Filter the aggregate cube based on the selected filters
+            with timed_span('filter'):
+                cube_filtered = get_filtered_cube(cube, filters)
+            
+            # Hand the report over to the export pool
+            job_id = submit_export_job(cube_filtered, template_path=app_config['template_path'], cache_key=cache_key)
+            
+            info_message = make_status_message("⏳ Generating report...", 
+                                               '#0051a6', '#e7f1ff', '#b8d4f5')
+            return (job_id, False, info_message, no_update)
                 
         except Exception as e:
             # Handle any exceptions that occur
-            import traceback
-            error_details = traceback.format_exc()
-            print("Download error: " + error_details)
+            logger.exception("Download error: %s", e)
             
-            error_message = html.Div("Error: " + str(e), 
-                   style={
-                       'color': '#dc3545', 
-                       'fontWeight': 'bold',
-                       'backgroundColor': '#f8d7da',
-                       'border': '1px solid #f5c6cb',
-                       'padding': '12px 20px',
-                       'borderRadius': '8px',
-                       'display': 'inline-block'
-                   })
-            
-            return (no_update, error_message)
+            error_message = make_status_message("Error: " + str(e), 
+                                                '#dc3545', '#f8d7da', '#f5c6cb')
+            return (no_update, True, error_message, no_update)
     
     # Return nothing if button hasn't been clicked
-    return no_update, ""
+    return no_update, no_update, "", no_update
+
+# Callback polling the export job until the report is ready
+def poll_export_job(n_intervals, job_id):
+    if not job_id:
+        return no_update, True, no_update
+    
+    status, result, elapsed = get_export_job_status(job_id)
+    
+    if status == 'running':
+        info_message = make_status_message("⏳ Generating report... (" + str(int(elapsed)) + "s)", 
+                                           '#0051a6', '#e7f1ff', '#b8d4f5')
+        return no_update, False, info_message
+    
+    if status == 'finished':
+        # The worker's stage timings count towards this process's metrics
+        for labels, seconds in result['spans']:
+            observe_latency('kpi_report_stage_seconds', labels, seconds)
+        
+        # Keep the report for the next download of the same selection
+        if result['cache_key']:
+            try:
+                store_cached_report(result['cache_key'], result['data'])
+            except OSError as e:
+                logger.warning("Could not cache report: %s", e)
+        
+        # Keep a copy on disk when a spool directory is configured
+        spool_exported_report(result['data'])
+        
+        # Return success response
+        success_message = make_status_message("✅ Report downloaded successfully!", 
+                                              '#28a745', '#d4edda', '#c3e6cb')
+        return (
+            dcc.send_bytes(result['data'], filename=result['filename']),
+            True,
+            success_message
+        )
+    
+    if status == 'failed':
+        logger.error("Download error: %s", result)
+        error_message = make_status_message("Error: " + str(result), 
+                                            '#dc3545', '#f8d7da', '#f5c6cb')
+        return no_update, True, error_message
+    
+    # The job id is unknown (e.g. the server restarted)
+    error_message = make_status_message("Error: report job not found, please try again.", 
+                                        '#dc3545', '#f8d7da', '#f5c6cb')
+    return no_update, True, error_message
+
+
+# Browser version of update_dashboard for client side filtering mode: the same
+# age range merging, KPIs and 5-year age groups, computed on the aggregate in
+# the age-cube-store and written into copies of the server's figure templates
+CLIENTSIDE_DASHBOARD_JS = """
+function(selected, store) {
+    if (!store) {
+        return Array(5).fill(window.dash_clientside.no_update);
+    }
+    if (typeof selected === 'string') {
+        selected = [selected];
+    }
+
+    // Selected categories -> sorted, merged age ranges (null = every age)
+    var ranges = null;
+    if (selected && selected.length && selected.indexOf('all') < 0) {
+        var parsed = selected.map(function(category) {
+            var parts = category.split('-');
+            return [parseInt(parts[0], 10), parseInt(parts[1], 10)];
+        }).sort(function(a, b) { return a[0] - b[0] || a[1] - b[1]; });
+        ranges = [];
+        parsed.forEach(function(range) {
+            var last = ranges[ranges.length - 1];
+            if (last && range[0] <= last[1] + 1) {
+                last[1] = Math.max(last[1], range[1]);
+            } else {
+                ranges.push([range[0], range[1]]);
+            }
+        });
+    }
+
+    var cube = store.cube;
+    var newUsers = 0, converted = 0, pages = 0;
+    var groups = {}, minGroup = null, maxGroup = null;
+    for (var i = 0; i < cube.age.length; i++) {
+        var age = cube.age[i];
+        if (ranges && !ranges.some(function(range) { return age >= range[0] && age <= range[1]; })) {
+            continue;
+        }
+        newUsers += cube.count[i] * cube.new_user[i];
+        converted += cube.converted[i];
+        pages += cube.total_pages_visited[i];
+        if (cube.count[i] > 0) {
+            var start = Math.floor(age / 5) * 5;
+            var group = groups[start] || (groups[start] = {users: 0, pages: 0, converted: 0});
+            group.users += cube.count[i];
+            group.pages += cube.total_pages_visited[i];
+            group.converted += cube.converted[i];
+            minGroup = minGroup === null ? start : Math.min(minGroup, start);
+            maxGroup = maxGroup === null ? start : Math.max(maxGroup, start);
+        }
+    }
+
+    // Same text as the server: "{:,}" for counts, Python's str() of the rounded rate
+    var rateText = '0';
+    if (pages > 0) {
+        var rate = Number((converted / pages * 100).toFixed(2));
+        rateText = Number.isInteger(rate) ? rate.toFixed(1) : String(rate);
+    }
+
+    var figures = store.figures;
+    var sitesFigure, conversionFigure;
+    if (minGroup === null) {
+        sitesFigure = figures.empty_sites;
+        conversionFigure = figures.empty_conversion;
+    } else {
+        var labels = [], pageTotals = [], conversionRates = [];
+        for (var start = minGroup; start <= maxGroup; start += 5) {
+            var group = groups[start] || {users: 0, pages: 0, converted: 0};
+            labels.push(start + '-' + (start + 4));
+            pageTotals.push(group.pages);
+            conversionRates.push(group.users > 0 ? group.converted / group.users * 100 : null);
+        }
+        sitesFigure = JSON.parse(JSON.stringify(figures.sites));
+        sitesFigure.data[0].x = labels;
+        sitesFigure.data[0].y = pageTotals;
+        conversionFigure = JSON.parse(JSON.stringify(figures.conversion));
+        conversionFigure.data[0].x = labels;
+        conversionFigure.data[0].y = conversionRates;
+    }
+
+    return [
+        newUsers.toLocaleString('en-US'),
+        converted.toLocaleString('en-US'),
+        rateText + '%',
+        sitesFigure,
+        conversionFigure
+    ];
+}
+"""
+
+# Callback reloading the browser's copy of the aggregate when rows are appended
+def refresh_client_dashboard_data(n_intervals):
+    if not refresh_dataset():
+        return no_update
+    return get_client_dashboard_data()
+
+# Function to format Prometheus labels, e.g. {stage="save"}
+def format_metric_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(name + '="' + value + '"')
+    return "{" + ",".join(parts) + "}"
+
+# Function to render every metric in the Prometheus text format
+def render_metrics():
+    with metrics_lock:
+        histograms = sorted((key, dict(histogram, buckets=list(histogram['buckets'])))
+                            for key, histogram in metric_histograms.items())
+    
+    lines = []
+    for metric_name, help_text in METRIC_HELP.items():
+        lines.append("# HELP " + metric_name + " " + help_text)
+        lines.append("# TYPE " + metric_name + " histogram")
+        for (name, labels), histogram in histograms:
+            if name != metric_name:
+                continue
+            for bound, count in zip(METRIC_BUCKETS, histogram['buckets']):
+                bucket_labels = labels + (('le', str(bound)),)
+                lines.append(metric_name + "_bucket" + format_metric_labels(bucket_labels) + " " + str(count))
+            lines.append(metric_name + "_bucket" + format_metric_labels(labels + (('le', '+Inf'),)) + " " + str(histogram['count']))
+            lines.append(metric_name + "_sum" + format_metric_labels(labels) + " " + repr(histogram['sum']))
+            lines.append(metric_name + "_count" + format_metric_labels(labels) + " " + str(histogram['count']))
+    
+    # Dashboard result cache counters
+    cache_stats = get_dashboard_cache_stats()
+    lines.append("# HELP kpi_report_dashboard_cache_hits_total Dashboard results served from the cache")
+    lines.append("# TYPE kpi_report_dashboard_cache_hits_total counter")
+    lines.append("kpi_report_dashboard_cache_hits_total " + str(cache_stats['hits']))
+    lines.append("# HELP kpi_report_dashboard_cache_misses_total Dashboard results that had to be computed")
+    lines.append("# TYPE kpi_report_dashboard_cache_misses_total counter")
+    lines.append("kpi_report_dashboard_cache_misses_total " + str(cache_stats['misses']))
+    lines.append("# HELP kpi_report_dashboard_cache_entries Dashboard results held in this process")
+    lines.append("# TYPE kpi_report_dashboard_cache_entries gauge")
+    lines.append("kpi_report_dashboard_cache_entries " + str(cache_stats['entries']))
+    
+    running_jobs = count_export_jobs()
+    lines.append("# HELP kpi_report_export_jobs Report export jobs waiting to be collected")
+    lines.append("# TYPE kpi_report_export_jobs gauge")
+    lines.append("kpi_report_export_jobs " + str(running_jobs))
+    return "\n".join(lines) + "\n"
+
+# Route serving the metrics to Prometheus
+def serve_metrics():
+    return flask.Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Function to register the dashboard callbacks on an app
+def register_callbacks(app):
+    dashboard_outputs = [Output('kpi-new-users', 'children'),
+                         Output('kpi-converted', 'children'),
+                         Output('kpi-conversion-rate', 'children'),
+                         Output('age-chart', 'figure'),
+                         Output('conversion-chart', 'figure')]
+    
+    if app_config['client_side_filtering']:
+        app.clientside_callback(
+            CLIENTSIDE_DASHBOARD_JS,
+            dashboard_outputs,
+            [Input('age-category-dropdown', 'value'),
+             Input('age-cube-store', 'data')]
+        )
+        app.callback(
+            Output('age-cube-store', 'data'),
+            [Input('live-refresh', 'n_intervals')],
+            prevent_initial_call=True
+        )(refresh_client_dashboard_data)
+    else:
+        app.callback(
+            dashboard_outputs,
+            [Input('age-category-dropdown', 'value'),
+             Input('user-type-dropdown', 'value'),
+             Input('pages-dropdown', 'value'),
+             Input('filter-match', 'value'),
+             Input('live-refresh', 'n_intervals')]
+        )(refresh_dashboard)
+    
+    app.callback(
+        [Output("export-job", "data"),
+         Output("export-poll", "disabled"),
+         Output("status-message", "children"),
+         Output("download-ppt", "data", allow_duplicate=True)],
+        [Input("download-btn", "n_clicks")],
+        [State('age-category-dropdown', 'value'),
+         State('user-type-dropdown', 'value'),
+         State('pages-dropdown', 'value'),
+         State('filter-match', 'value')],
+        prevent_initial_call=True
+    )(download_ppt)
+    
+    app.callback(
+        [Output("download-ppt", "data"),
+         Output("export-poll", "disabled", allow_duplicate=True),
+         Output("status-message", "children", allow_duplicate=True)],
+        [Input("export-poll", "n_intervals")],
+        [State("export-job", "data")],
+        prevent_initial_call=True
+    )(poll_export_job)
+
+# Function to create the Dash app, nothing heavy happens on import of this module
+def create_app(config=None):
+    global dataset
+    # Every app starts from the defaults, not from what an earlier call set
+    new_config = dict(DEFAULT_CONFIG, **(config or {}))
+    with dataset_lock:
+        if any(new_config[setting] != app_config[setting] for setting in DATASET_SETTINGS):
+            dataset = None
+        app_config.clear()
+        app_config.update(new_config)
+    
+    app = dash.Dash(__name__)
+    app.layout = build_layout
+    register_callbacks(app)
+    app.server.route('/metrics')(serve_metrics)
+    
+    if app_config['preload_data']:
+        get_dataset()
+    return app
+
+# Function returning the WSGI server, e.g.
+# gunicorn --preload "main:create_server({'preload_data': True})"
+def create_server(config=None):
+    return create_app(config).server
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    app = create_app()
     app.run_server(debug=True, port=8070)
\ No newline at end of file